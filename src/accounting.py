@@ -0,0 +1,389 @@
+'''
+Project:    Pi Floor Light
+
+File:       src/accounting.py
+
+Title:      Energy and Duty Accounting
+
+Abstract:   This module records how long and how bright the LEDs run. The accounting is
+            fed by every PWM write of the LedPair and integrates duty x time per channel:
+            on every write the elapsed time since the previous write is multiplied by the
+            duty cycles that were active and added to the totals and to the current buckets.
+            An update is O(1), plus one bucket switch per minute boundary crossed while on.
+
+            While the duty cycle does not change, the owner calls update() regularly (the
+            control loops: every accounting.T_update seconds), so an ongoing on-period is
+            accounted as it runs. On open, the time since the last update of the previous
+            run is accounted with its last duty cycles (the PWM keeps running while the
+            service restarts), up to T_GAP_MAX. Queries add the part since the last update,
+            up to T_GAP_MAX as well: a service which was stopped or crashed without close()
+            leaves its last duty cycles behind.
+
+            The unit is full-on seconds (duty/100 x seconds), i.e. the time the channel
+            would have needed at 100% for the same energy. Multiplied by the power of the
+            strip at 100% it gives the energy.
+
+            The data lives in a small memory-mapped file (~50 KB) which survives restarts:
+
+                - lifetime totals per channel (full-on seconds, on-time seconds)
+                - ring of N_MINUTE per-minute buckets (last 24 hours)
+                - ring of N_HOUR per-hour buckets (last 31 days)
+                - ring of N_DAY per-day buckets (last year, local days)
+
+            Every ring slot is tagged with its bucket id (epoch minute, epoch hour, date
+            ordinal), so stale slots are detected without clearing the whole ring.
+
+            Layout (little endian, fixed size):
+                magic (4s), version (H), n_channel (H), n_minute (H), n_hour (H), n_day (H),
+                pad (H), t_last (d),
+                pins (N_CHANNEL_MAX x i), duty (N_CHANNEL_MAX x d),
+                full_on (N_CHANNEL_MAX x d), on_time (N_CHANNEL_MAX x d),
+                per ring: ids (n x I), values (n x N_CHANNEL_MAX x f)
+
+            Query the totals with the CLI, e.g.:
+
+                python3 src/accounting.py                       (summary, path from the config)
+                python3 src/accounting.py --period hour -n 24   (last 24 hours)
+                python3 src/accounting.py a.bin b.bin --watts 24
+
+Author:     Dr. Oliver Opalko
+
+Email:      oliver.opalko@gmail.com
+
+'''
+#!/usr/bin/env python3
+import os
+import mmap
+import time
+import struct
+import argparse
+import datetime
+from pathlib import Path
+import utils
+
+######################################################################################################
+# Constants
+######################################################################################################
+
+MAGIC           = b"FLAC"
+VERSION         = 1
+N_CHANNEL_MAX   = 4
+N_MINUTE        = 24 * 60   # Per-minute buckets: last 24 hours
+N_HOUR          = 31 * 24   # Per-hour buckets: last 31 days
+N_DAY           = 366       # Per-day buckets: last year
+HEADER          = struct.Struct("<4sHHHHHHd")
+OFFSET_T_LAST   = 16
+OFFSET_PINS     = HEADER.size
+OFFSET_DUTY     = OFFSET_PINS + 4 * N_CHANNEL_MAX
+OFFSET_FULL_ON  = OFFSET_DUTY + 8 * N_CHANNEL_MAX
+OFFSET_ON_TIME  = OFFSET_FULL_ON + 8 * N_CHANNEL_MAX
+OFFSET_RINGS    = OFFSET_ON_TIME + 8 * N_CHANNEL_MAX
+PIN_NONE        = -1
+T_GAP_MAX       = 600.0     # Max. time since the last update of the previous run which is accounted on open
+ACCOUNTING_PATH = "~/.local/share/floorlight/accounting.bin"
+
+MINUTE = "minute"
+HOUR   = "hour"
+DAY    = "day"
+
+######################################################################################################
+# Private Helper Functions
+######################################################################################################
+def _get_bucket_id(period, t):
+    """Return the bucket id and the end time of the bucket containing time t."""
+    if period == MINUTE:
+        bucket_id = int(t // 60)
+        return bucket_id, (bucket_id + 1) * 60.0
+    if period == HOUR:
+        bucket_id = int(t // 3600)
+        return bucket_id, (bucket_id + 1) * 3600.0
+    date = datetime.date.fromtimestamp(t)
+    return date.toordinal(), _get_bucket_start(DAY, date.toordinal() + 1)
+
+def _get_bucket_start(period, bucket_id):
+    """Return the start time (time.time()) of a bucket."""
+    if period == MINUTE:
+        return bucket_id * 60.0
+    if period == HOUR:
+        return bucket_id * 3600.0
+    return time.mktime(datetime.date.fromordinal(bucket_id).timetuple())
+
+######################################################################################################
+# Bucket Ring
+######################################################################################################
+class _Ring:
+    """Fixed-size ring of buckets in the mapping, one float per channel."""
+    def __init__(self, mm, offset, period, n):
+        self.period = period
+        self.n      = n
+        self.size   = 4 * n + 4 * n * N_CHANNEL_MAX
+        self.ids    = memoryview(mm)[offset:offset + 4 * n].cast("I")
+        self.values = memoryview(mm)[offset + 4 * n:offset + self.size].cast("f")
+        self.base   = 0     # Index of the current slot's first value
+        self.t_end  = 0.0   # End time of the current bucket
+
+    def advance(self, t):
+        """Switch to the bucket containing time t, clearing a stale slot."""
+        bucket_id, self.t_end = _get_bucket_id(self.period, t)
+        i = bucket_id % self.n
+        self.base = i * N_CHANNEL_MAX
+        if self.ids[i] != bucket_id:
+            self.ids[i] = bucket_id
+            for i_channel in range(N_CHANNEL_MAX):
+                self.values[self.base + i_channel] = 0.0
+
+    def get(self, bucket_id):
+        """Return the values of a bucket, zeros if it was not recorded."""
+        i = bucket_id % self.n
+        if self.ids[i] != bucket_id:
+            return [0.0] * N_CHANNEL_MAX
+        return list(self.values[i * N_CHANNEL_MAX:(i + 1) * N_CHANNEL_MAX])
+
+    def release(self):
+        self.ids.release()
+        self.values.release()
+
+######################################################################################################
+# Energy Accounting
+######################################################################################################
+class EnergyAccounting:
+    """Incremental duty x time accounting in a memory-mapped file.
+
+    Parameters:
+        path (str): Path of the accounting file.
+        b_read_only (bool): Open for queries only (e.g. the CLI while the service runs).
+    """
+    def __init__(self, path=ACCOUNTING_PATH, b_read_only=False):
+        self.path        = Path(path).expanduser()
+        self.b_read_only = b_read_only
+        size = OFFSET_RINGS + sum(4 * n * (1 + N_CHANNEL_MAX) for n in (N_MINUTE, N_HOUR, N_DAY))
+        if b_read_only:
+            with open(self.path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size != size:
+                    os.ftruncate(fd, size)
+                self._mm = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+
+        header = HEADER.unpack_from(self._mm, 0)
+        if header[:6] != (MAGIC, VERSION, N_CHANNEL_MAX, N_MINUTE, N_HOUR, N_DAY):
+            if b_read_only:
+                raise ValueError(f"{self.path} is not an accounting file of version {VERSION}")
+            self._mm[:] = bytes(size)
+            HEADER.pack_into(self._mm, 0, MAGIC, VERSION, N_CHANNEL_MAX, N_MINUTE, N_HOUR, N_DAY, 0, 0.0)
+            struct.pack_into("<{}i".format(N_CHANNEL_MAX), self._mm, OFFSET_PINS, *[PIN_NONE] * N_CHANNEL_MAX)
+
+        self.pins    = memoryview(self._mm)[OFFSET_PINS:OFFSET_DUTY].cast("i")
+        self.duty    = memoryview(self._mm)[OFFSET_DUTY:OFFSET_FULL_ON].cast("d")
+        self.full_on = memoryview(self._mm)[OFFSET_FULL_ON:OFFSET_ON_TIME].cast("d")
+        self.on_time = memoryview(self._mm)[OFFSET_ON_TIME:OFFSET_RINGS].cast("d")
+        self.rings   = {}
+        offset = OFFSET_RINGS
+        for period, n in ((MINUTE, N_MINUTE), (HOUR, N_HOUR), (DAY, N_DAY)):
+            self.rings[period] = _Ring(self._mm, offset, period, n)
+            offset += self.rings[period].size
+
+        # Private attributes
+        self._channels = {pin: i for i, pin in enumerate(self.pins) if pin != PIN_NONE}
+        self.t_last    = HEADER.unpack_from(self._mm, 0)[7]  # Time of the last update
+        if not b_read_only:
+            t_now = time.time()
+            if self.t_last > 0:
+                # Account the gap since the last update of the previous run with its
+                # duty cycles. A longer gap means the host was down and the LEDs off.
+                for ring in self.rings.values():
+                    ring.advance(self.t_last)
+                self._integrate(min(t_now, self.t_last + T_GAP_MAX))
+            else:
+                self._set_t_last(t_now)
+            # The new run starts with the LEDs off, its first PWM write sets the duty
+            for i in range(N_CHANNEL_MAX):
+                self.duty[i] = 0.0
+            for ring in self.rings.values():
+                ring.advance(self.t_last)
+            self._integrate(t_now)
+
+    #########################################################
+    # Private Helper Methods
+    #########################################################
+
+    def _set_t_last(self, t):
+        self.t_last = t
+        struct.pack_into("<d", self._mm, OFFSET_T_LAST, t)
+
+    def _get_channel(self, pin):
+        i = self._channels.get(pin)
+        if i is None:
+            if len(self._channels) >= N_CHANNEL_MAX:
+                raise ValueError(f"Accounting supports at most {N_CHANNEL_MAX} channels")
+            i = len(self._channels)
+            self.pins[i] = pin
+            self._channels[pin] = i
+        return i
+
+    def _get_pending(self, t_start, t_end):
+        """Full-on seconds per channel at the current duty cycles between
+        t_start and t_end, limited to the time since the last update and
+        to T_GAP_MAX after it (as accounted on the next open)."""
+        dt = max(0.0, min(t_end, time.time(), self.t_last + T_GAP_MAX) - max(t_start, self.t_last))
+        return [duty / 100.0 * dt for duty in self.duty]
+
+    def _integrate(self, t):
+        """Add duty x time since the last update to the totals and buckets."""
+        t_from = self.t_last
+        if t <= t_from:
+            # Clock stepped back (NTP): restart the integration from here
+            self._set_t_last(t)
+            return
+        minute, hour, day = self.rings[MINUTE], self.rings[HOUR], self.rings[DAY]
+        active = [(i, duty / 100.0) for i, duty in enumerate(self.duty) if duty > 0]
+        if not active:
+            # Off: nothing to add, just move to the current buckets
+            if t >= minute.t_end:
+                for ring in (minute, hour, day):
+                    if t >= ring.t_end:
+                        ring.advance(t)
+            self._set_t_last(t)
+            return
+        while t_from < t:
+            t_to = min(t, minute.t_end)
+            dt = t_to - t_from
+            for i, x in active:
+                x_dt = x * dt
+                self.full_on[i] += x_dt
+                self.on_time[i] += dt
+                minute.values[minute.base + i] += x_dt
+                hour.values[hour.base + i] += x_dt
+                day.values[day.base + i] += x_dt
+            t_from = t_to
+            if t_from >= minute.t_end:
+                for ring in (minute, hour, day):
+                    if t_from >= ring.t_end:
+                        if ring is hour:
+                            self._mm.flush()  # Limit the loss on power failure to an hour
+                        ring.advance(t_from)
+        self._set_t_last(t)
+
+    #########################################################
+    # Public Methods
+    #########################################################
+
+    def set_duty(self, pin_a, duty_a, pin_b=None, duty_b=None):
+        """Account the time since the last update and record the new duty
+        cycle (percent) of one or two channels. Called on every PWM write."""
+        self._integrate(time.time())
+        self.duty[self._get_channel(pin_a)] = duty_a
+        if pin_b is not None:
+            self.duty[self._get_channel(pin_b)] = duty_b
+
+    def update(self):
+        """Account the time until now. Called regularly while the duty cycle
+        does not change, and before a query in the same process."""
+        if not self.b_read_only:
+            self._integrate(time.time())
+
+    def get_totals(self):
+        """Return the lifetime totals per channel, including the ongoing
+        on-period since the last update.
+        Returns:
+            dict: pin -> (full-on seconds, on-time seconds).
+        """
+        t_now = time.time()
+        pending = self._get_pending(self.t_last, t_now)
+        dt = max(0.0, min(t_now, self.t_last + T_GAP_MAX) - self.t_last)
+        return {pin: (self.full_on[i] + pending[i], self.on_time[i] + (dt if self.duty[i] > 0 else 0.0))
+                for pin, i in self._channels.items()}
+
+    def get_duty(self):
+        """Return the current duty cycles (percent) per channel.
+        Returns:
+            dict: pin -> duty cycle.
+        """
+        return {pin: self.duty[i] for pin, i in self._channels.items()}
+
+    def get_buckets(self, period, n, t=None):
+        """Return the last n buckets of a period (MINUTE, HOUR, DAY), newest
+        first, including the ongoing on-period since the last update. Buckets
+        without data are zero.
+        Returns:
+            list: (start time, {pin: full-on seconds}) tuples.
+        """
+        ring = self.rings[period]
+        bucket_id = _get_bucket_id(period, time.time() if t is None else t)[0]
+        buckets = []
+        for k in range(min(n, ring.n)):
+            values = ring.get(bucket_id - k)
+            t_start = _get_bucket_start(period, bucket_id - k)
+            pending = self._get_pending(t_start, _get_bucket_start(period, bucket_id - k + 1))
+            buckets.append((t_start, {pin: values[i] + pending[i] for pin, i in self._channels.items()}))
+        return buckets
+
+    def close(self):
+        """Account the time until now, flush the mapping and unmap it."""
+        self.update()
+        for ring in self.rings.values():
+            ring.release()
+        for view in (self.pins, self.duty, self.full_on, self.on_time):
+            view.release()
+        if not self.b_read_only:
+            self._mm.flush()
+        self._mm.close()
+
+######################################################################################################
+# Main
+######################################################################################################
+def _format_energy(full_on_s, watts):
+    text = "{:9.2f} h".format(full_on_s / 3600)
+    if watts:
+        text += " {:9.1f} Wh".format(full_on_s / 3600 * watts)
+    return text
+
+def main():
+    parser = argparse.ArgumentParser(description="Pi Floor Light energy and duty accounting")
+    parser.add_argument("paths", nargs="*", help="Accounting files (default: path from the config)")
+    parser.add_argument("--config", default="./config/static_config.yaml")
+    parser.add_argument("--watts", type=float, help="Power of a channel at 100%% duty in W (default: from the config)")
+    parser.add_argument("--period", choices=[MINUTE, HOUR, DAY], help="List buckets instead of the summary")
+    parser.add_argument("-n", type=int, default=24, help="Number of buckets to list")
+    args = parser.parse_args()
+
+    config = {}
+    if Path(args.config).exists():
+        config = utils.load_config(args.config).get("accounting") or {}
+    paths = args.paths or [config.get("path", ACCOUNTING_PATH)]
+    watts = args.watts if args.watts is not None else config.get("watts")
+
+    for path in paths:
+        accounting = EnergyAccounting(path, b_read_only=True)
+        try:
+            print("## {} (last update {}, now: {})".format(
+                accounting.path, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(accounting.t_last)),
+                ", ".join("pin {} at {:.1f}%".format(pin, duty) for pin, duty in accounting.get_duty().items() if duty > 0) or "off"))
+            if args.period is None:
+                day = accounting.get_buckets(HOUR, 24)
+                week = accounting.get_buckets(DAY, 7)
+                width = max(17, len(_format_energy(0.0, watts)))
+                print("{:>4}  {:>{w}}  {:>10}  {:>{w}}  {:>{w}}  {:>13}".format(
+                    "pin", "lifetime full-on", "on-time", "last 24 h full-on", "last 7 days", "mean duty 24h", w=width))
+                for pin, (full_on, on_time) in accounting.get_totals().items():
+                    full_on_day = sum(values[pin] for t, values in day)
+                    full_on_week = sum(values[pin] for t, values in week)
+                    print("{:>4}  {:>{w}}  {:8.2f} h  {:>{w}}  {:>{w}}  {:12.2f}%".format(
+                        pin, _format_energy(full_on, watts), on_time / 3600,
+                        _format_energy(full_on_day, watts), _format_energy(full_on_week, watts),
+                        100 * full_on_day / (24 * 3600), w=width))
+            else:
+                for t_start, values in accounting.get_buckets(args.period, args.n):
+                    print("{}  {}".format(
+                        time.strftime("%Y-%m-%d %H:%M", time.localtime(t_start)),
+                        "  ".join("pin {}: {:9.1f} s".format(pin, value) for pin, value in values.items())))
+        finally:
+            accounting.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+'''
+Project:    Pi Floor Light
+
+File:       src/bench.py
+
+Title:      Benchmarks for Pi Floor Light
+
+Abstract:   This module contains benchmarks for the timing critical parts of the project.
+            Benchmarks which do not need hardware use simulated sensors and LEDs, so they
+            can also run on a development machine. Run from the project root, e.g.:
+
+                python3 src/bench.py closed_loop
+                python3 src/bench.py motion --pin 20    (needs pigpiod)
+                python3 src/bench.py motion_events
+                python3 src/bench.py pigpio_recovery   (uses a local fake pigpiod)
+                python3 src/bench.py drivers           (--pigpiod: use the running pigpiod)
+                python3 src/bench.py coordination      (--n: number of walks)
+
+Author:     Dr. Oliver Opalko
+
+Email:      oliver.opalko@gmail.com
+
+'''
+#!/usr/bin/env python3
+import os
+import argparse
+import time
+import utils
+from luxcontrol import LuxStream, ClosedLoopLux
+
+######################################################################################################
+# Simulated Hardware
+######################################################################################################
+class SimRoom:
+    """Simulated room: the light sensor sees daylight plus the light of the LEDs.
+
+    Parameters:
+        lux_daylight (float): Daylight at the sensor in lux.
+        lux_per_duty (float): Lux at the sensor per duty percent of LED A.
+        T_read (float): Duration of one sensor read in seconds (BH1750 high-res ~0.12-0.18 s).
+    """
+    def __init__(self, lux_daylight=50.0, lux_per_duty=2.0, T_read=0.12):
+        self.lux_daylight = lux_daylight
+        self.lux_per_duty = lux_per_duty
+        self.T_read       = T_read
+        self.duty         = 0.0
+
+    # LedPair interface
+    def set_duty_ab(self, duty):
+        self.duty = duty
+
+    # BH1750 interface
+    def read_lux(self):
+        time.sleep(self.T_read)
+        return self.lux_daylight + self.lux_per_duty * self.duty
+
+class SimDriver:
+    """LedDriver without hardware, every call takes the declared write time.
+
+    Parameters:
+        capabilities (DriverCapabilities): Capabilities to simulate.
+    """
+    def __init__(self, capabilities):
+        self.capabilities = capabilities
+        self.duty         = {}
+
+    def set_duty(self, pin, duty):
+        time.sleep(self.capabilities.T_write)
+        self.duty[pin] = duty
+
+    def set_duties(self, duties):
+        if self.capabilities.b_batching:
+            time.sleep(self.capabilities.T_write)
+            self.duty.update(duties)
+        else:
+            for pin, duty in duties:
+                self.set_duty(pin, duty)
+
+    def close(self):
+        pass
+
+class CountingDriver:
+    """Wraps a LedDriver and counts the calls and their time."""
+    def __init__(self, driver):
+        self.driver       = driver
+        self.capabilities = driver.capabilities
+        self.n_call       = 0
+        self.T_sum        = 0.0
+        self.T_max        = 0.0
+
+    def _count(self, t_start):
+        T = time.perf_counter() - t_start
+        self.n_call += 1
+        self.T_sum += T
+        if T > self.T_max:
+            self.T_max = T
+
+    def set_duty(self, pin, duty):
+        t_start = time.perf_counter()
+        self.driver.set_duty(pin, duty)
+        self._count(t_start)
+
+    def set_duties(self, duties):
+        t_start = time.perf_counter()
+        self.driver.set_duties(duties)
+        self._count(t_start)
+
+    def close(self):
+        self.driver.close()
+
+######################################################################################################
+# Benchmarks
+######################################################################################################
+def bench_closed_loop(config, duration=12.0):
+    """Run the closed-loop controller against SimRoom: settle to target_lux,
+    then double the daylight and settle again. Reports loop timing and
+    settling times."""
+    room = SimRoom()
+    stream = LuxStream(room.read_lux)
+    stream.start()
+    stream.wait_for_first()
+    loop = ClosedLoopLux(room, stream, config)
+    loop.start(0.0)
+
+    print("## Setpoint step: 0 -> {} lux (daylight {} lux)".format(loop.target_lux, room.lux_daylight))
+    loop.run(duration=duration/2)
+    loop.print_stats()
+
+    room.lux_daylight *= 2
+    loop.restart_settling()
+    print("## Disturbance: daylight -> {} lux".format(room.lux_daylight))
+    loop.run(duration=duration/2)
+    loop.print_stats()
+    stream.stop()
+
+def bench_motion(pin, n_edge=200, T_edge=0.01, debounce_us=0):
+    """Toggle a spare output pin with pigpio and measure the dispatch
+    latency of the MotionInput (edge tick in pigpiod to handler call).
+    Needs a running pigpiod."""
+    from motion import MotionInput
+    import pigpio
+    motion = MotionInput([], debounce_us=debounce_us)
+    motion.pi.set_mode(pin, pigpio.OUTPUT)
+    motion.pi.write(pin, 0)
+    motion.add_pin(pin, b_input=False)
+    n_handled = [0]
+    motion.add_handler(lambda pin, level, tick: n_handled.__setitem__(0, n_handled[0] + 1))
+    try:
+        for i in range(n_edge):
+            motion.pi.write(pin, (i + 1) % 2)
+            time.sleep(T_edge)
+        time.sleep(0.1)
+        print("## Motion input: {} edges written, {} handled".format(n_edge, n_handled[0]))
+        motion.print_latency_stats()
+    finally:
+        motion.pi.write(pin, 0)
+        motion.close()
+
+def bench_motion_events(config, n_pulse=400, seed=1):
+    """Replay a scripted noisy PIR stream (random pulses and short glitches)
+    through the MotionHysteresis engine and report the ramps saved."""
+    import random
+    from motionevents import MotionHysteresis, replay, ON, OFF
+    cfg = config.get("motion_events", {})
+    engine = MotionHysteresis(
+            coalesce=cfg.get("coalesce", 0.5),
+            hold_on =cfg.get("hold_on", 30.0),
+            extend  =cfg.get("extend", 15.0),
+            min_off =cfg.get("min_off", 3.0))
+    rng = random.Random(seed)
+    edges = []
+    t = 0.0
+    for i in range(n_pulse):
+        t += rng.expovariate(1/10)            # Mean 10 s between pulses
+        edges.append((t, 1))
+        if rng.random() < 0.3:                # Glitch: short drop-out within the pulse
+            t += rng.uniform(0.01, 0.2)
+            edges.append((t, 0))
+            t += rng.uniform(0.01, 0.2)
+            edges.append((t, 1))
+        t += rng.uniform(0.1, 3.0)
+        edges.append((t, 0))
+    actions = replay(engine, edges, t_end=t + engine.hold_on + engine.min_off)
+    print("## Motion events: {} scripted edges over {:.0f} s -> {} actions".format(len(edges), t, len(actions)))
+    engine.print_stats()
+
+    # A PIR pulse longer than hold_on must still be followed by the full hold-on time
+    T_pulse = 4 * engine.hold_on
+    check = MotionHysteresis(
+            coalesce=engine.coalesce,
+            hold_on =engine.hold_on,
+            extend  =engine.extend,
+            min_off =engine.min_off)
+    actions = replay(check, [(0.0, 1), (T_pulse, 0)], t_end=T_pulse + 2 * engine.hold_on)
+    b_ok = actions == [(0.0, ON), (T_pulse + engine.hold_on, OFF)]
+    print("Long pulse ({:.0f} s): {} -> {}".format(T_pulse, actions, "OK" if b_ok else "FAILED"))
+
+def bench_pigpio_recovery(port=18888, n_kill=5, T_down=0.5, T_health=0.2, T_steady=2.0, T_write=0.0005):
+    """Run a ManagedPi against a healthy local fake pigpiod for T_steady
+    seconds with ticks in the upper half of the 32 bit range (no reconnect
+    expected), then kill and restart the daemon while the ManagedPi drives
+    two hardware PWM pins and a writer thread calls it every T_write
+    seconds. Reports the recovery time (daemon back up to duty replayed)
+    and checks the replayed duty cycles, the writer and a PIR pin whose
+    level changed while the daemon was down."""
+    import threading
+    from fakepigpiod import FakePigpiod
+    from pigpioconn import ManagedPi
+    from motion import MotionInput
+
+    daemon = FakePigpiod(port=port, tick_start=2**31).start()
+    pi = ManagedPi(port=port, T_health=T_health)
+    time.sleep(T_steady)
+    print("## Steady state: {} reconnects in {} s (health check {} s, ticks from 2^31)".format(
+        pi.n_reconnect, T_steady, T_health))
+    n_reconnect_steady = pi.n_reconnect
+
+    pin_pir = 21
+    motion = MotionInput([pin_pir], debounce_us=0, pi=pi)
+    n_write, errors, b_run = [0], [], [True]
+
+    def writer():
+        while b_run[0]:
+            try:
+                pi.hardware_PWM(18, 200, 500000)
+                n_write[0] += 1
+            except Exception as e:
+                errors.append(e)
+            time.sleep(T_write)
+
+    thread = threading.Thread(target=writer, daemon=True)
+    thread.start()
+    T_recovery = []
+    try:
+        for i in range(n_kill):
+            pwm = {12: (200, 10000 * (i + 1)), 13: (200, 2500 * (i + 1))}
+            for gpio, (frequency, duty) in pwm.items():
+                pi.hardware_PWM(gpio, frequency, duty)
+            pi.write(pin_pir, 1)  # PIR high before the kill, low on the restarted daemon
+            time.sleep(0.05)
+            daemon.stop()
+            time.sleep(T_down)
+            daemon = FakePigpiod(port=port).start()
+            t_up = time.monotonic()
+            n_reconnect = pi.n_reconnect
+            while pi.n_reconnect == n_reconnect and time.monotonic() - t_up < 10:
+                time.sleep(0.001)
+            T_recovery.append(time.monotonic() - t_up)
+            time.sleep(0.05)
+            b_replayed = all(daemon.hardware_pwm.get(gpio) == value for gpio, value in pwm.items())
+            print("Kill #{}: recovered {:.3f} s after restart (detect to replay {:.3f} s), duty replayed: {}, PIR level re-read: {}".format(
+                i + 1, T_recovery[-1], pi.T_recovery_last, b_replayed, not motion.any.motion_detected))
+        print("## pigpiod recovery over {} kills (down {} s, health check {} s): mean {:.3f} s, max {:.3f} s after restart".format(
+            n_kill, T_down, T_health, sum(T_recovery) / len(T_recovery), max(T_recovery)))
+    finally:
+        b_run[0] = False
+        thread.join()
+        print("Writer: {} calls, {} errors{}, {} reconnects in steady state".format(
+            n_write[0], len(errors), " ({!r})".format(errors[0]) if errors else "", n_reconnect_steady))
+        motion.close()
+        pi.stop()
+        daemon.stop()
+
+def bench_drivers(config, b_pigpiod=False, port=18888):
+    """Run the same ramps through every LED backend and compare the plan of
+    the RampEngine with the achieved ramp time and the write cost. pigpio
+    talks to a local fake pigpiod (real socket protocol) unless b_pigpiod,
+    RPi.GPIO is simulated with its declared capabilities if not installed."""
+    from leddriver import LedPair, RPI_GPIO
+    from led_pigpio import PigpioDriver
+    from pigpioconn import ManagedPi
+    from fakepigpiod import FakePigpiod
+
+    pins  = (config["led"]["pin_a"], config["led"]["pin_b"])
+    f_pwm = config["pwm"]["frequency"]
+    daemon = None
+    if not b_pigpiod:
+        daemon = FakePigpiod(port=port).start()
+    pi = ManagedPi(port=None if b_pigpiod else port)
+    drivers = [("pigpio" if b_pigpiod else "pigpio (fake pigpiod)", PigpioDriver(pi, pins, f_pwm))]
+    try:
+        from led import RPiGPIODriver
+        drivers.append(("RPi.GPIO", RPiGPIODriver(pins, f_pwm)))
+    except ImportError:
+        drivers.append(("RPi.GPIO (simulated)", SimDriver(RPI_GPIO)))
+
+    print("## Capability matrix")
+    for name, driver in drivers:
+        print(driver.capabilities.format())
+    ramps = [(0, 100), (100, 0), (0, 10), (10, 1)]
+    try:
+        for name, driver in drivers:
+            counting = CountingDriver(driver)
+            led = LedPair(counting, config, duty_b_factor=1/4)
+            print("## {} @ {} Hz, T_ramp {} s".format(name, f_pwm, led.T_ramp))
+            for duty_start, duty_end in ramps:
+                led.set_duty_ab(duty_start)
+                counting.n_call, counting.T_sum, counting.T_max = 0, 0.0, 0.0
+                t_start = time.monotonic()
+                plan = led.ramp_ab(duty_start, duty_end, b_print=False)
+                T = time.monotonic() - t_start
+                print("{:>3}% -> {:>3}%: {:>4} steps of {:5.1f} ms ({}), {:.3f} s vs. {:.3f} s planned, "
+                      "{} calls, write mean {:.0f} us, max {:.0f} us".format(
+                    duty_start, duty_end, plan["n_step"], 1e3 * plan["T_step"], plan["strategy"],
+                    T, plan["T_ramp"], counting.n_call,
+                    1e6 * counting.T_sum / max(1, counting.n_call), 1e6 * counting.T_max))
+            led.close()
+    finally:
+        pi.stop()
+        if daemon is not None:
+            daemon.stop()
+
+def bench_coordination(n_node=4, n_walk=20, T_segment=0.5, T_read=0.024):
+    """Walk past n_node controllers on a local bus (one segment every
+    T_segment seconds, alternating direction). Every controller runs a
+    simulated loop, not LEDControl: a re-implementation of the wake-up path
+    of the hysteresis loop which blocks on a wake event shared by its
+    simulated PIR and the coordinator, publishes its own motion and waits
+    T_read seconds (BH1750 low-res one-shot) in place of the light reading
+    before it pre-ramps. LED ramps, PIR dispatch and scene lookup are not
+    included. Reports the bus and end-to-end latency and how many
+    pre-ramps were ahead of the walker."""
+    import tempfile
+    import threading
+    from coordination import Coordinator, LatencyStats
+
+    bus_dir = tempfile.mkdtemp(prefix="floorlight-bus-")
+    pir  = [threading.Event() for i in range(n_node)]  # Simulated PIR level
+    wake = [threading.Event() for i in range(n_node)]
+    nodes = [Coordinator("node{}".format(i), i, bus_dir=bus_dir, reach=1.0, window=2 * T_segment, wake=wake[i])
+             for i in range(n_node)]
+    t_pre = [[] for i in range(n_node)]  # Times of the pre-ramps per node
+    b_run = [True]
+
+    def control_loop(i):
+        b_motion = False
+        while b_run[0]:
+            t_now = time.monotonic()
+            b_motion_now = pir[i].is_set()
+            if b_motion_now != b_motion:
+                b_motion = b_motion_now
+                if b_motion:
+                    nodes[i].publish_motion(t_now)
+            t_edge = nodes[i].take_pre_ramp()
+            if t_edge is not None and not b_motion:
+                time.sleep(T_read)  # Light level for the duty cycle of the pre-ramp
+                nodes[i].record_pre_ramp(t_edge)
+                t_pre[i].append(time.monotonic())
+            wake[i].wait()
+            wake[i].clear()
+
+    threads = [threading.Thread(target=control_loop, args=(i,), daemon=True) for i in range(n_node)]
+    for thread in threads:
+        thread.start()
+    n_behind, T_lead = 0, []
+    try:
+        for walk in range(n_walk):
+            order = range(n_node) if walk % 2 == 0 else range(n_node - 1, -1, -1)
+            t_arrival = {}
+            for i in order:
+                t_arrival[i] = time.monotonic()
+                pir[i].set()
+                wake[i].set()
+                time.sleep(T_segment)
+                pir[i].clear()
+                wake[i].set()
+            time.sleep(2 * T_segment)  # Separate the walks (direction window)
+            for i in range(n_node):
+                for t in t_pre[i]:
+                    if t < t_arrival[i]:
+                        T_lead.append(t_arrival[i] - t)
+                    else:
+                        n_behind += 1
+                t_pre[i] = []
+    finally:
+        b_run[0] = False
+        for i in range(n_node):
+            wake[i].set()
+        for thread in threads:
+            thread.join()
+        bus, e2e = LatencyStats("Bus"), LatencyStats("End-to-end")
+        for node in nodes:
+            for stats, node_stats in ((bus, node.latency_bus), (e2e, node.latency_e2e)):
+                stats.n += node_stats.n
+                stats.sum_us += node_stats.sum_us
+                stats.max_us = max(stats.max_us, node_stats.max_us)
+                stats.samples.extend(node_stats.samples)
+            node.close()
+        os.rmdir(bus_dir)
+    print("## {} simulated controllers, {} walks, {} s per segment, simulated lux read {:.0f} ms".format(
+        n_node, n_walk, T_segment, 1e3 * T_read))
+    print(bus.format())
+    print(e2e.format())
+    print("Pre-ramps: {} ahead of the walker (mean {:.3f} s before the own PIR), {} behind".format(
+        len(T_lead), sum(T_lead) / len(T_lead) if T_lead else 0.0, n_behind))
+
+######################################################################################################
+# Main
+######################################################################################################
+def main():
+    parser = argparse.ArgumentParser(description="Pi Floor Light benchmarks")
+    parser.add_argument("benchmark", choices=["closed_loop", "motion", "motion_events", "pigpio_recovery", "drivers", "coordination"])
+    parser.add_argument("--config", default="./config/static_config.yaml")
+    parser.add_argument("--duration", type=float, default=12.0, help="Seconds, half per phase (closed_loop benchmark)")
+    parser.add_argument("--pin", type=int, default=20, help="Spare GPIO pin (motion benchmark)")
+    parser.add_argument("--n", type=int, help="Number of edges (motion, default 200) or walks (coordination, default 20)")
+    parser.add_argument("--pigpiod", action="store_true", help="Use the running pigpiod (drivers benchmark)")
+    args = parser.parse_args()
+    config = utils.load_config(args.config)
+
+    if args.benchmark == "closed_loop":
+        bench_closed_loop(config, duration=args.duration)
+    elif args.benchmark == "motion":
+        bench_motion(args.pin, n_edge=args.n or 200)
+    elif args.benchmark == "motion_events":
+        bench_motion_events(config)
+    elif args.benchmark == "pigpio_recovery":
+        bench_pigpio_recovery()
+    elif args.benchmark == "drivers":
+        bench_drivers(config, b_pigpiod=args.pigpiod)
+    elif args.benchmark == "coordination":
+        bench_coordination(n_walk=args.n or 20)
+
+if __name__ == "__main__":
+    main()
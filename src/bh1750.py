@@ -1,6 +1,8 @@
 # src/bh1750.py
 # Minimal driver for the BH1750 light sensor on Raspberry Pi via I2C.
+import os
 import time
+import fcntl
 import smbus
 from pathlib import Path
 import utils
@@ -25,19 +27,56 @@ ONE_TIME_HIRES_1  = 0x20
 ONE_TIME_HIRES_2  = 0x21
 ONE_TIME_LORES    = 0x23
 
+HIRES_MODES    = (CONTINUOUS_HIRES_MODE, CONTINUOUS_HIRES_MODE_2, ONE_TIME_HIRES_1, ONE_TIME_HIRES_2)
+HIRES_2_MODES  = (CONTINUOUS_HIRES_MODE_2, ONE_TIME_HIRES_2)  # 0.5 lx resolution -> raw / 2
+ONE_TIME_MODES = (ONE_TIME_HIRES_1, ONE_TIME_HIRES_2, ONE_TIME_LORES)
+
+# Measurement time register (MTreg). Sensitivity scales with MTreg/69, and so
+# does the measurement time. Changing MTreg needs two writes (high/low bits).
+MTREG_MIN      = 31
+MTREG_DEFAULT  = 69
+MTREG_MAX      = 254
+MTREG_HIGH_BIT = 0x40  # 01000_MT[7,6,5]
+MTREG_LOW_BIT  = 0x60  # 011_MT[4,3,2,1,0]
+
+# Plain I2C reads (no command byte) via the i2c-dev interface
+I2C_BUS   = 1
+I2C_SLAVE = 0x0703  # ioctl: set the slave address of the file descriptor
+
+# Max. measurement times at MTREG_DEFAULT (datasheet)
+T_HIRES_MAX = 0.18   # ~180 ms
+T_LORES_MAX = 0.024  # ~24 ms
+
 class BH1750:
     """Class for interfacing with the BH1750 light sensor via I2C."""
-    def __init__(self, addr=ADDR_LOW, mode=CONTINUOUS_HIRES_MODE, lux_max=400):
+    def __init__(self, addr=ADDR_LOW, mode=CONTINUOUS_HIRES_MODE, lux_max=400, lux_dark=10, mtreg_dark=MTREG_DEFAULT):
         """
         Constructor: Initialize the BH1750 sensor.
+
+        With a one-time mode the sensor is left powered down and only woken
+        up by the measurement command itself (see read_lux_adaptive).
         """
         self.addr = addr
-        self.bus  = smbus.SMBus(1)
+        self.bus  = smbus.SMBus(I2C_BUS)
+        # The BH1750 returns the result on a plain 2-byte read. An SMBus block
+        # read would send the mode byte first and start another measurement.
+        self._fd  = os.open("/dev/i2c-{}".format(I2C_BUS), os.O_RDWR)
+        fcntl.ioctl(self._fd, I2C_SLAVE, addr)
         self.mode = mode
+        self.mtreg = MTREG_DEFAULT
         self.lux_max = lux_max
+        self.lux_dark = lux_dark
+        self.mtreg_dark = max(MTREG_DEFAULT, min(MTREG_MAX, int(mtreg_dark)))
+        self.b_dark = False  # Adaptive reads are in the dark range
+        self.calibration = None  # Optional calibration.Calibration lookup table
+        self.lux_last = None  # Last light level in lux, of every read mode
         self._write(POWER_ON)
         time.sleep(0.02)
-        self.set_mode(mode)
+        if mode in ONE_TIME_MODES:
+            self.mode = mode
+            self.power_down()
+        else:
+            self.set_mode(mode)
 
     def _write(self, byte):
         """
@@ -51,6 +90,16 @@ class BH1750:
         """
         self._write(POWER_DOWN)
 
+    def close(self):
+        """
+        Power down the sensor and close the I2C bus.
+        """
+        try:
+            self.power_down()
+        finally:
+            os.close(self._fd)
+            self.bus.close()
+
     def reset(self):
         """
         Reset the sensor (must be powered on).
@@ -64,6 +113,34 @@ class BH1750:
         self.mode = mode
         self._write(mode)
 
+    def set_mtreg(self, mtreg):
+        """
+        Set the measurement time register (sensitivity), clamped to [31, 254].
+        Costs two I2C writes, so it is skipped when the value does not change.
+        """
+        mtreg = max(MTREG_MIN, min(MTREG_MAX, int(mtreg)))
+        if mtreg == self.mtreg:
+            return
+        self._write(MTREG_HIGH_BIT | (mtreg >> 5))
+        self._write(MTREG_LOW_BIT | (mtreg & 0x1F))
+        self.mtreg = mtreg
+
+    def _get_wait_time(self, mode):
+        """
+        Max. measurement time of mode at the current MTreg.
+        """
+        T_max = T_HIRES_MAX if mode in HIRES_MODES else T_LORES_MAX
+        return T_max * self.mtreg / MTREG_DEFAULT
+
+    def _raw_to_lux(self, raw, mode):
+        """
+        Convert a raw 16-bit count to lux. Factor from datasheet ~1.2.
+        """
+        lux = raw / 1.2 * MTREG_DEFAULT / self.mtreg
+        if mode in HIRES_2_MODES:
+            lux = lux / 2
+        return lux
+
     def lux_to_duty_cycle(self, lux, lux_min=0, duty_min=1, duty_max=100, b_print=True):
         """
         Convert lux value to duty cycle percentage. For low light levels, return duty_min. 
@@ -73,8 +150,11 @@ class BH1750:
             lux_min (float): Minimum lux threshold for duty cycle mapping.
             duty_min (float): Minimum duty cycle percentage.
             duty_max (float): Maximum duty cycle percentage.
+        With a calibration, the duty cycle is looked up in its table instead.
         """
-        if lux <= lux_min:
+        if self.calibration is not None:
+            duty_cycle = self.calibration.duty_for_lux(lux)
+        elif lux <= lux_min:
             duty_cycle = duty_min
         elif lux >= self.lux_max:
             duty_cycle = 0
@@ -86,21 +166,91 @@ class BH1750:
         print("Converted lux {:.2f} to duty cycle {:.2f}%".format(lux, duty_cycle))
         return duty_cycle
 
+    def read_raw(self, mode=None):
+        """
+        Read the raw 16-bit count. One-time modes are triggered here and
+        the sensor powers down by itself after the measurement.
+        """
+        if mode is None:
+            mode = self.mode
+        # For CONT_* modes, setting mode once in __init__ is sufficient.
+        if mode in ONE_TIME_MODES:
+            self._write(mode)
+        # Wait time depending on mode and MTreg (rough wait time)
+        time.sleep(self._get_wait_time(mode))
+
+        # Read 2 bytes (plain read, no command byte)
+        data = os.read(self._fd, 2)
+        if len(data) != 2:
+            raise OSError("Short read from BH1750: {} bytes".format(len(data)))
+        return (data[0] << 8) | data[1]
+
+    def read_duty_cycle(self, b_print=False):
+        """
+        Read the light level and map it to a duty cycle. With a calibration
+        in high-res mode at default MTreg the raw count indexes the
+        calibration table directly.
+        """
+        if self.calibration is not None and self.mode in (CONTINUOUS_HIRES_MODE, ONE_TIME_HIRES_1) \
+                and self.mtreg == MTREG_DEFAULT:
+            raw = self.read_raw()
+            self.lux_last = self._raw_to_lux(raw, self.mode)
+            duty_cycle = self.calibration.duty_for_raw(raw)
+            if b_print:
+                print("Converted raw {} to duty cycle {}%".format(raw, duty_cycle))
+            return duty_cycle
+        return self.lux_to_duty_cycle(self.read_lux(), b_print=b_print)
+
     def read_lux(self, b_print=False):
         """
         Read light level in lux.
         """
-        # Wait time depending on mode (rough wait time)
-        if self.mode in (CONTINUOUS_HIRES_MODE, CONTINUOUS_HIRES_MODE_2, ONE_TIME_HIRES_1, ONE_TIME_HIRES_2):
-            time.sleep(0.18)   # ~180 ms
-        else:
-            time.sleep(0.024)  # ~24 ms
-
-        # Read 2 bytes and convert to lux. Factor from datasheet ~1.2.
-        # For CONT_* modes, setting mode once in __init__ is sufficient.
-        data = self.bus.read_i2c_block_data(self.addr, self.mode)
-        raw = (data[0] << 8) | data[1]
-        lux = raw / 1.2
+        raw = self.read_raw()
+        lux = self._raw_to_lux(raw, self.mode)
+        self.lux_last = lux
         if b_print:
             print("Measured light level: {:.2f} lux".format(lux))
         return lux
+
+    def read_lux_once(self, mode=ONE_TIME_LORES, b_print=False):
+        """
+        Single measurement in a one-time mode, sensor is powered down afterwards.
+        """
+        raw = self.read_raw(mode)
+        lux = self._raw_to_lux(raw, mode)
+        self.lux_last = lux
+        if b_print:
+            print("Measured light level (mode 0x{:02X}, MTreg {}): {:.2f} lux".format(mode, self.mtreg, lux))
+        return lux
+
+    def read_lux_adaptive(self, b_print=False):
+        """
+        Read light level with as little latency and I2C traffic as the
+        decision needs:
+            - A low-res one-shot (~24 ms, 4 lx resolution) is enough to tell
+              bright from dark and to map lux to duty (1 duty % ~ 4 lx at 400 lx).
+            - Below lux_dark, a high-res mode 2 one-shot at MTreg mtreg_dark
+              resolves the lowest duty cycles.
+        The dark range is sticky with hysteresis (2*lux_dark), so MTreg is only
+        rewritten when the light level crosses it and a dark room costs a
+        single one-shot per read (plus the low-res one on the read that
+        crosses into it).
+        mtreg_dark trades the latency of the read which gates the light at
+        night against resolution: at the default MTreg 69 the dark read takes
+        ~180 ms (as the continuous high-res mode) for 0.5 lx, MTreg 138 takes
+        ~360 ms for 0.25 lx, MTreg 254 ~660 ms for 0.14 lx.
+        """
+        if self.b_dark:
+            lux = self.read_lux_once(ONE_TIME_HIRES_2)
+            if lux > 2*self.lux_dark:
+                self.b_dark = False
+                self.set_mtreg(MTREG_DEFAULT)
+        else:
+            lux = self.read_lux_once(ONE_TIME_LORES)
+            if lux < self.lux_dark:
+                self.b_dark = True
+                self.set_mtreg(self.mtreg_dark)
+                lux = self.read_lux_once(ONE_TIME_HIRES_2)
+        if b_print:
+            print("Measured light level (adaptive, MTreg {}): {:.2f} lux".format(self.mtreg, lux))
+        return lux
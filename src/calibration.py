@@ -0,0 +1,192 @@
+'''
+Project:    Pi Floor Light
+
+File:       src/calibration.py
+
+Title:      Lux to Duty Cycle Calibration
+
+Abstract:   This module provides a calibration lookup table which maps the raw 16-bit count
+            of the BH1750 directly to the final duty cycle of the LED strip. The table is
+            built from a calibration file with measured (lux, preferred duty) points, which
+            are linearly interpolated. This way the non-linear response of real LED strips
+            can be expressed, and a reading maps to a duty cycle with a single array index.
+
+            The calibration file is hot-reloadable: maybe_reload() checks its modification
+            time and rebuilds the table if it changed. Built tables are cached on disk, keyed
+            by a hash of the calibration file and the shut-down lux level.
+
+            Calibration file format (YAML):
+
+                points:
+                  - {lux: 0,   duty: 3}
+                  - {lux: 50,  duty: 20}
+                  - {lux: 300, duty: 80}
+
+Author:     Dr. Oliver Opalko
+
+Email:      oliver.opalko@gmail.com
+
+'''
+#!/usr/bin/env python3
+import os
+import math
+import time
+import hashlib
+from pathlib import Path
+import yaml
+
+######################################################################################################
+# Constants
+######################################################################################################
+
+N_RAW          = 65536   # BH1750 raw range (16 bit)
+RAW_PER_LUX    = 1.2     # High-res mode at default MTreg (datasheet)
+LUT_VERSION    = 1       # Bump when the table layout or interpolation changes
+T_RELOAD_CHECK = 1.0     # Min. time between two checks of the calibration file (seconds)
+CACHE_DIR      = "~/.cache/floorlight"
+
+######################################################################################################
+# Calibration
+######################################################################################################
+class Calibration:
+    """Lookup table from BH1750 raw counts to duty cycle (percent).
+
+    Parameters:
+        path (str): Path to the calibration file.
+        lux_max (float): Lux level at which the LED stays off (duty 0).
+        cache_dir (str): Directory for cached tables, None disables the cache.
+    """
+    def __init__(self, path, lux_max=400, cache_dir=CACHE_DIR):
+        # Public attributes
+        self.path      = Path(path)
+        self.lux_max   = lux_max
+        self.cache_dir = Path(cache_dir).expanduser() if cache_dir else None
+        self.points    = []
+        self.lut       = bytes(N_RAW)
+
+        # Private attributes
+        self._mtime_ns  = None
+        self._t_checked = 0.0
+
+        self.load()
+
+    #########################################################
+    # Private Helper Methods
+    #########################################################
+
+    def _parse_points(self, data):
+        """Parse and validate the calibration points.
+        Returns:
+            list: Sorted list of (lux, duty) tuples.
+        """
+        points = []
+        for point in data.get("points", []):
+            lux  = float(point["lux"])
+            duty = float(point["duty"])
+            if lux < 0 or not 0 <= duty <= 100:
+                raise ValueError(f"Invalid calibration point lux={lux}, duty={duty}")
+            points.append((lux, duty))
+        if not points:
+            raise ValueError(f"No calibration points in {self.path}")
+        points.sort()
+        return points
+
+    def _build_lut(self, points):
+        """Build the raw -> duty table by linear interpolation between the
+        points. Below the first point the first duty is used, above the last
+        point the last duty, from lux_max on the duty is 0.
+        Returns:
+            bytes: Table with N_RAW duty cycle entries (0..100).
+        """
+        lut = bytearray(N_RAW)
+        raw_max = min(N_RAW, math.ceil(self.lux_max * RAW_PER_LUX))
+        i_point = 0
+        for raw in range(raw_max):
+            lux = raw / RAW_PER_LUX
+            while i_point < len(points) - 1 and lux >= points[i_point + 1][0]:
+                i_point += 1
+            lux_0, duty_0 = points[i_point]
+            if lux <= lux_0 or i_point == len(points) - 1:
+                duty = duty_0
+            else:
+                lux_1, duty_1 = points[i_point + 1]
+                duty = duty_0 + (lux - lux_0) * (duty_1 - duty_0) / (lux_1 - lux_0)
+            # Ceil the result (same rounding as BH1750.lux_to_duty_cycle)
+            lut[raw] = math.ceil(duty)
+        return bytes(lut)
+
+    def _get_cache_path(self, file_bytes):
+        key = hashlib.sha1(file_bytes)
+        key.update("{}:{}".format(LUT_VERSION, self.lux_max).encode())
+        return self.cache_dir / "lut_{}.bin".format(key.hexdigest())
+
+    def _load_or_build_lut(self, file_bytes, points):
+        """Load the table from the disk cache or build and cache it."""
+        if self.cache_dir is None:
+            return self._build_lut(points)
+        cache_path = self._get_cache_path(file_bytes)
+        try:
+            lut = cache_path.read_bytes()
+            if len(lut) == N_RAW:
+                return lut
+        except OSError:
+            pass
+        lut = self._build_lut(points)
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            # Write atomically, a reader never sees a partial table
+            tmp_path = cache_path.with_suffix(".tmp")
+            tmp_path.write_bytes(lut)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Error caching calibration table in {self.cache_dir}: {e}")
+        return lut
+
+    #########################################################
+    # Public Methods
+    #########################################################
+
+    def load(self):
+        """(Re)load the calibration file and swap in the new table."""
+        mtime_ns = os.stat(self.path).st_mtime_ns
+        file_bytes = self.path.read_bytes()
+        points = self._parse_points(yaml.safe_load(file_bytes) or {})
+        lut = self._load_or_build_lut(file_bytes, points)
+        # Swap in one assignment, readers see either the old or the new table
+        self.points    = points
+        self.lut       = lut
+        self._mtime_ns = mtime_ns
+
+    def maybe_reload(self, b_print=True):
+        """Reload the calibration file if it changed. Checks at most every
+        T_RELOAD_CHECK seconds; a broken file keeps the current table.
+        Returns:
+            bool: True if the table was reloaded.
+        """
+        t_now = time.monotonic()
+        if t_now - self._t_checked < T_RELOAD_CHECK:
+            return False
+        self._t_checked = t_now
+        try:
+            if os.stat(self.path).st_mtime_ns == self._mtime_ns:
+                return False
+            self.load()
+        except (OSError, ValueError, KeyError, TypeError, yaml.YAMLError) as e:
+            print(f"Error reloading calibration from {self.path}: {e}")
+            return False
+        if b_print:
+            print("Reloaded calibration from {} ({} points)".format(self.path, len(self.points)))
+        return True
+
+    def duty_for_raw(self, raw):
+        """Duty cycle (percent) for a raw BH1750 count (high-res, default MTreg)."""
+        return self.lut[raw]
+
+    def duty_for_lux(self, lux):
+        """Duty cycle (percent) for a lux value."""
+        raw = int(lux * RAW_PER_LUX)
+        if raw >= N_RAW:
+            raw = N_RAW - 1
+        elif raw < 0:
+            raw = 0
+        return self.lut[raw]
@@ -0,0 +1,290 @@
+'''
+Project:    Pi Floor Light
+
+File:       src/coordination.py
+
+Title:      Multi-Controller Coordination (Follow-Me Lighting)
+
+Abstract:   This module lets several floorlight controllers, e.g. one per hallway segment,
+            light the way ahead of a walking person. Every controller publishes its motion
+            events on a local bus, and its neighbours pre-ramp along the direction of travel
+            before their own PIR fires.
+
+            The bus is a directory of Unix datagram sockets, one per controller. Publishing
+            sends one small fixed-size datagram to every other socket in the directory; no
+            broker process is needed. Each message carries the monotonic time of the PIR edge.
+            CLOCK_MONOTONIC is shared by all processes of a host, so the receiver measures the
+            propagation latency directly. Controllers on several Pis need a network transport
+            with the same publish / receive interface instead (and a clock sync for latencies).
+
+            Every controller has a position along the hallway (e.g. 0, 1, 2, ...). FollowMe
+            derives the direction of travel from the last two events within a time window and
+            tells a controller to pre-ramp if it is within reach of the event and ahead in the
+            direction of travel (or on both sides while the direction is unknown).
+
+            Measured are the bus latency (PIR edge to message received) and the end-to-end
+            latency (PIR edge at the neighbour to the start of the own pre-ramp). A control
+            loop can pass a wake event which it shares with its PIR, so it blocks on both
+            without polling.
+
+Author:     Dr. Oliver Opalko
+
+Email:      oliver.opalko@gmail.com
+
+'''
+#!/usr/bin/env python3
+import os
+import time
+import socket
+import struct
+import threading
+from collections import deque
+
+######################################################################################################
+# Constants
+######################################################################################################
+
+MAGIC       = b"FLCO"
+VERSION     = 1
+MOTION      = 1
+MESSAGE     = struct.Struct("<4sBBH16sIdd")  # magic, version, kind, pad, node, seq, position, t_edge
+BUS_DIR     = "/tmp/floorlight-bus"
+SUFFIX      = ".sock"
+T_PEERS     = 1.0   # Max. age of the cached peer list in seconds
+N_LATENCY   = 1024  # Number of latency samples kept for percentiles
+
+######################################################################################################
+# Latency Statistics
+######################################################################################################
+class LatencyStats:
+    """Running latency statistics with a bounded sample window for percentiles."""
+    def __init__(self, name):
+        self.name    = name
+        self.n       = 0
+        self.sum_us  = 0.0
+        self.max_us  = 0.0
+        self.samples = deque(maxlen=N_LATENCY)
+
+    def add(self, latency):
+        latency_us = max(0.0, 1e6 * latency)
+        self.n += 1
+        self.sum_us += latency_us
+        if latency_us > self.max_us:
+            self.max_us = latency_us
+        self.samples.append(latency_us)
+
+    def get_stats(self):
+        """Return the latency statistics in microseconds.
+        Returns:
+            dict: n, mean, p50, p99 and max latency.
+        """
+        samples = sorted(self.samples)
+        n = len(samples)
+        return {
+            "n":       self.n,
+            "mean_us": self.sum_us / self.n if self.n else 0.0,
+            "p50_us":  samples[n // 2] if n else 0.0,
+            "p99_us":  samples[min(n - 1, int(n * 0.99))] if n else 0.0,
+            "max_us":  self.max_us,
+        }
+
+    def format(self):
+        stats = self.get_stats()
+        return "{} latency over {} events: mean {:.0f} us, p50 {:.0f} us, p99 {:.0f} us, max {:.0f} us".format(
+            self.name, stats["n"], stats["mean_us"], stats["p50_us"], stats["p99_us"], stats["max_us"])
+
+######################################################################################################
+# Follow-Me Logic
+######################################################################################################
+class FollowMe:
+    """Decide from the motion events of all controllers whether this one
+    should pre-ramp. Pure logic on explicit timestamps.
+
+    Parameters:
+        position (float): Position of this controller along the hallway.
+        reach (float): Max. distance of an event which triggers a pre-ramp.
+        window (float): Two events within this time (seconds) give the direction.
+    """
+    def __init__(self, position, reach=1.0, window=5.0):
+        self.position  = position
+        self.reach     = reach
+        self.window    = window
+        self.direction = 0  # +1 / -1 along the positions, 0 unknown
+
+        # Private attributes
+        self._t_last        = None
+        self._position_last = None
+
+    def feed(self, t, position):
+        """Process a motion event at position and time t (own events too).
+        Returns:
+            bool: True if this controller should pre-ramp.
+        """
+        if self._t_last is not None and t - self._t_last <= self.window:
+            if position != self._position_last:
+                self.direction = 1 if position > self._position_last else -1
+        else:
+            self.direction = 0
+        self._t_last = t
+        self._position_last = position
+
+        distance = self.position - position
+        if distance == 0 or abs(distance) > self.reach:
+            return False
+        return self.direction == 0 or distance * self.direction > 0
+
+######################################################################################################
+# Coordinator
+######################################################################################################
+class Coordinator:
+    """Publish the motion events of this controller and receive the ones of
+    its neighbours over Unix datagram sockets.
+
+    Parameters:
+        name (str): Unique name of the controller (max. 16 bytes), also the socket name.
+        position (float): Position along the hallway.
+        bus_dir (str): Directory of the bus sockets, shared by all controllers.
+        reach (float): Max. distance of an event which triggers a pre-ramp.
+        window (float): Two events within this time (seconds) give the direction.
+        wake (threading.Event): Optional event which is set with pre_ramp, e.g. shared
+            with the PIR callbacks of the control loop.
+    """
+    def __init__(self, name, position, bus_dir=BUS_DIR, reach=1.0, window=5.0, wake=None):
+        self.name     = name
+        self.node     = name.encode()[:16]
+        self.position = float(position)
+        self.bus_dir  = bus_dir
+        self.path     = os.path.join(bus_dir, name + SUFFIX)
+        self.follow   = FollowMe(self.position, reach=reach, window=window)
+        self.pre_ramp = threading.Event()  # Set when a pre-ramp is due
+        self.wake     = wake
+        self.latency_bus = LatencyStats("Coordination bus")
+        self.latency_e2e = LatencyStats("Coordination end-to-end")
+        self.n_publish   = 0
+        self.n_receive   = 0
+        self.n_pre_ramp  = 0
+
+        # Private attributes
+        self._seq        = 0
+        self._peers      = []
+        self._t_peers    = 0.0
+        self._t_edge     = None  # PIR edge time of the event behind the pending pre-ramp
+        self._lock       = threading.Lock()
+        self._b_stop     = False
+
+        os.makedirs(bus_dir, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # Stale socket of a previous run
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self.path)
+        self._sock_send = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock_send.setblocking(False)
+        self._thread = threading.Thread(target=self._receive_loop, daemon=True)
+        self._thread.start()
+
+    #########################################################
+    # Private Helper Methods
+    #########################################################
+
+    def _get_peers(self):
+        """Return the socket paths of the other controllers, cached for T_PEERS."""
+        t_now = time.monotonic()
+        if t_now - self._t_peers > T_PEERS:
+            self._peers = [entry.path for entry in os.scandir(self.bus_dir)
+                           if entry.name.endswith(SUFFIX) and entry.path != self.path]
+            self._t_peers = t_now
+        return self._peers
+
+    def _receive_loop(self):
+        while True:
+            try:
+                data = self._sock.recv(MESSAGE.size)
+            except OSError:
+                return
+            t_receive = time.monotonic()
+            if self._b_stop:
+                return
+            if len(data) != MESSAGE.size:
+                continue
+            magic, version, kind, pad, node, seq, position, t_edge = MESSAGE.unpack(data)
+            if magic != MAGIC or version != VERSION or kind != MOTION or node == self.node:
+                continue
+            self.n_receive += 1
+            self.latency_bus.add(t_receive - t_edge)
+            with self._lock:
+                if self.follow.feed(t_edge, position):
+                    self._t_edge = t_edge
+                    self.pre_ramp.set()
+                    if self.wake is not None:
+                        self.wake.set()
+
+    #########################################################
+    # Public Methods
+    #########################################################
+
+    def publish_motion(self, t_edge=None):
+        """Publish a motion event (t_edge: time.monotonic() of the PIR edge)
+        to all other controllers on the bus."""
+        if t_edge is None:
+            t_edge = time.monotonic()
+        self._seq = (self._seq + 1) & 0xFFFFFFFF
+        data = MESSAGE.pack(MAGIC, VERSION, MOTION, 0, self.node, self._seq, self.position, t_edge)
+        with self._lock:
+            self.follow.feed(t_edge, self.position)
+        for path in self._get_peers():
+            try:
+                self._sock_send.sendto(data, path)
+            except OSError:
+                # Stopped controller, full receive queue or a foreign file in
+                # the bus directory: the event is dropped
+                pass
+        self.n_publish += 1
+
+    def take_pre_ramp(self):
+        """Return and clear a pending pre-ramp.
+        Returns:
+            float: time.monotonic() of the neighbour's PIR edge, None if no pre-ramp is due.
+        """
+        if not self.pre_ramp.is_set():
+            return None
+        with self._lock:
+            self.pre_ramp.clear()
+            t_edge, self._t_edge = self._t_edge, None
+        return t_edge
+
+    def record_pre_ramp(self, t_edge):
+        """Count a pre-ramp and record its end-to-end latency when it starts."""
+        self.n_pre_ramp += 1
+        self.latency_e2e.add(time.monotonic() - t_edge)
+
+    def get_stats(self):
+        """Return the event counts and latency statistics.
+        Returns:
+            dict: Statistics of the coordinator.
+        """
+        return {
+            "n_publish":   self.n_publish,
+            "n_receive":   self.n_receive,
+            "n_pre_ramp":  self.n_pre_ramp,
+            "latency_bus": self.latency_bus.get_stats(),
+            "latency_e2e": self.latency_e2e.get_stats(),
+        }
+
+    def print_stats(self):
+        print("Coordination {}: {} published, {} received, {} pre-ramps".format(
+            self.name, self.n_publish, self.n_receive, self.n_pre_ramp))
+        print(self.latency_bus.format())
+        print(self.latency_e2e.format())
+
+    def close(self):
+        """Stop the receiver and remove the socket from the bus."""
+        self._b_stop = True
+        try:
+            self._sock_send.sendto(b"", self.path)  # Wake up the receiver
+        except OSError:
+            pass
+        self._thread.join(timeout=1.0)
+        self._sock.close()
+        self._sock_send.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
@@ -0,0 +1,222 @@
+'''
+Project:    Pi Floor Light
+
+File:       src/fakepigpiod.py
+
+Title:      Fake pigpio Daemon
+
+Abstract:   This module provides a minimal fake of the pigpio daemon which speaks the pigpio
+            socket protocol on localhost. It implements the commands used by this project
+            (modes, pulls, read/write, glitch filter, hardware PWM, tick, notifications) and
+            records the state of every pin, so the ManagedPi reconnect and replay can be tested
+            without a Raspberry Pi. stop() closes all sockets at once like a killed daemon.
+
+            Standalone usage (kill it with Ctrl-C and start it again):
+
+                python3 src/fakepigpiod.py --port 8888
+
+Author:     Dr. Oliver Opalko
+
+Email:      oliver.opalko@gmail.com
+
+'''
+#!/usr/bin/env python3
+import time
+import socket
+import struct
+import argparse
+import threading
+
+######################################################################################################
+# Constants
+######################################################################################################
+
+CMD_MODES = 0
+CMD_PUD   = 2
+CMD_READ  = 3
+CMD_WRITE = 4
+CMD_BR1   = 10
+CMD_TICK  = 16
+CMD_NB    = 19
+CMD_NC    = 21
+CMD_HP    = 86
+CMD_FG    = 97
+CMD_NOIB  = 99
+
+TICK_MASK = 0xFFFFFFFF
+
+######################################################################################################
+# Fake pigpio Daemon
+######################################################################################################
+class FakePigpiod:
+    """Fake pigpio daemon on a local TCP port.
+
+    Parameters:
+        host (str): Host to listen on.
+        port (int): Port to listen on.
+        tick_start (int): Tick (us) at the start, e.g. 2**31 to serve ticks in the upper
+            half of the 32 bit range. None: derived from time.monotonic().
+    """
+    def __init__(self, host="localhost", port=8888, tick_start=None):
+        self.host = host
+        self.port = port
+        self.tick_start = tick_start
+        # Pin state
+        self.modes        = {}  # gpio -> mode
+        self.pulls        = {}  # gpio -> pud
+        self.glitch       = {}  # gpio -> steady (us)
+        self.hardware_pwm = {}  # gpio -> (frequency, duty)
+        self.levels       = 0   # Bit mask of the gpio levels
+        self.n_command    = 0
+
+        # Private attributes
+        self._lock     = threading.Lock()
+        self._server   = None
+        self._conns    = []
+        self._notify   = {}  # handle -> [socket, monitor bits, seq]
+        self._b_running = False
+        self._t_start   = time.monotonic()
+
+    #########################################################
+    # Private Helper Methods
+    #########################################################
+
+    def _recv_exact(self, conn, n):
+        buf = b""
+        while len(buf) < n:
+            chunk = conn.recv(n - len(buf))
+            if not chunk:
+                return None
+            buf += chunk
+        return buf
+
+    def _tick(self):
+        if self.tick_start is None:
+            return int(time.monotonic() * 1000000) & TICK_MASK
+        return (self.tick_start + int((time.monotonic() - self._t_start) * 1000000)) & TICK_MASK
+
+    def _report(self, changed):
+        """Send a level report to all notification sockets monitoring a changed gpio."""
+        tick = self._tick()
+        for entry in self._notify.values():
+            conn, monitor, seq = entry
+            if monitor & changed:
+                entry[2] = (seq + 1) & 0xFFFF
+                try:
+                    conn.sendall(struct.pack("HHII", seq, 0, tick, self.levels))
+                except OSError:
+                    pass
+
+    def _handle(self, conn, cmd, p1, p2, ext):
+        """Execute a command.
+        Returns:
+            int: Result of the command.
+        """
+        with self._lock:
+            self.n_command += 1
+            if cmd == CMD_MODES:
+                self.modes[p1] = p2
+            elif cmd == CMD_PUD:
+                self.pulls[p1] = p2
+            elif cmd == CMD_READ:
+                return (self.levels >> p1) & 1
+            elif cmd == CMD_WRITE:
+                levels = (self.levels & ~(1 << p1)) | ((p2 & 1) << p1)
+                changed = levels ^ self.levels
+                self.levels = levels
+                if changed:
+                    self._report(changed)
+            elif cmd == CMD_BR1:
+                return self.levels
+            elif cmd == CMD_TICK:
+                return self._tick()
+            elif cmd == CMD_FG:
+                self.glitch[p1] = p2
+            elif cmd == CMD_HP:
+                self.hardware_pwm[p1] = (p2, struct.unpack("I", ext[:4])[0])
+            elif cmd == CMD_NOIB:
+                handle = len(self._notify)
+                self._notify[handle] = [conn, 0, 0]
+                return handle
+            elif cmd == CMD_NB:
+                if p1 in self._notify:
+                    self._notify[p1][1] = p2
+            elif cmd == CMD_NC:
+                self._notify.pop(p1, None)
+            return 0
+
+    def _serve(self, conn):
+        b_notify = False
+        try:
+            while self._b_running:
+                header = self._recv_exact(conn, 16)
+                if header is None:
+                    break
+                cmd, p1, p2, p3 = struct.unpack("IIII", header)
+                ext = self._recv_exact(conn, p3) if p3 else b""
+                res = self._handle(conn, cmd, p1, p2, ext)
+                # A notification socket only answers NOIB, afterwards it carries reports.
+                # The result is unsigned on the wire (pigpio converts negative error codes)
+                if not b_notify:
+                    conn.sendall(struct.pack("IIII", cmd, p1, p2, res & 0xFFFFFFFF))
+                b_notify = b_notify or cmd == CMD_NOIB
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def _accept_loop(self):
+        while self._b_running:
+            try:
+                conn, addr = self._server.accept()
+            except OSError:
+                break
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._conns.append(conn)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    #########################################################
+    # Public Methods
+    #########################################################
+
+    def start(self):
+        """Start listening (like starting pigpiod)."""
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((self.host, self.port))
+        self._server.listen()
+        self._b_running = True
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        """Close all sockets at once (like killing pigpiod)."""
+        self._b_running = False
+        for sock in [self._server] + self._conns:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        self._conns = []
+        self._notify = {}
+
+######################################################################################################
+# Main
+######################################################################################################
+def main():
+    parser = argparse.ArgumentParser(description="Fake pigpio daemon")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8888)
+    args = parser.parse_args()
+    daemon = FakePigpiod(args.host, args.port).start()
+    print("Fake pigpiod listening on {}:{}".format(args.host, args.port))
+    try:
+        while True:
+            time.sleep(1)
+            print("Hardware PWM: {}".format(daemon.hardware_pwm))
+    except KeyboardInterrupt:
+        daemon.stop()
+
+if __name__ == "__main__":
+    main()
@@ -8,10 +8,22 @@ from __future__ import annotations
 
 import math
 import time
+import socket
+import threading
 # from socket import timeout
 from gpiozero import MotionSensor
 from led_pigpio import LedPair
+import bh1750
 from bh1750 import BH1750
+from calibration import Calibration
+from motion import MotionInput
+import motionevents
+from motionevents import MotionHysteresis
+from statefile import StateFile
+from accounting import EnergyAccounting
+from scenes import SceneSchedule
+from coordination import Coordinator
+from luxcontrol import LuxStream, ClosedLoopLux
 
 class LEDControl:
     """Represent a PIR/motion sensor connected to a GPIO input.
@@ -30,10 +42,6 @@ class LEDControl:
         # GPIO setup to BCM mode (explanation: https://pinout.xyz/pinout/bcm)
         try:
             self.config = config
-            # Motion sensor related parameters
-            self.pir_pin = int(config["motion_sensor"]["pin"])
-            self.pir     = MotionSensor(self.pir_pin)
-
             # LED related parameters
             self.led_pin_a         = config["led"]["pin_a"]
             self.led_pin_b         = config["led"]["pin_b"]
@@ -43,7 +51,82 @@ class LEDControl:
             self.led = LedPair(
                 config       =self.config,
                 duty_b_factor=self.led_duty_b_factor)
-            self.light_sensor = BH1750(lux_max=config["light_sensor"]["shut_down_at_lux"])
+
+            # Persistent state snapshot to resume after a restart
+            self.state  = None
+            self.resume = None
+            if config.get("state", {}).get("path"):
+                self.state  = StateFile(config["state"]["path"])
+                self.resume = self.state.get_resume(max_age=config["state"].get("max_age"))
+                self.led.state = self.state
+
+            # Energy and duty accounting, fed by every PWM write
+            self.accounting = None
+            self.accounting_T_update = config.get("accounting", {}).get("T_update", 60.0)
+            self._t_accounting = 0.0
+            if config.get("accounting", {}).get("enabled", False):
+                self.accounting = EnergyAccounting(config["accounting"]["path"])
+                self.led.accounting = self.accounting
+
+            # Motion sensor related parameters
+            self.pir_pin     = int(config["motion_sensor"]["pin"])
+            self.pir_backend = config["motion_sensor"].get("backend", "gpiozero")
+            self.motion      = None
+            if self.pir_backend == "pigpio":
+                # Edge callbacks over the pigpio connection of the LED pair
+                self.motion = MotionInput(
+                    pins       =[self.pir_pin] + list(config["motion_sensor"].get("pins_extra", [])),
+                    debounce_us=config["motion_sensor"].get("debounce_us", 10000),
+                    pi         =self.led.pwm)
+                # All PIR pins drive the LEDs: motion while any of them is high
+                self.pir = self.motion.any
+            else:
+                self.pir = MotionSensor(self.pir_pin)
+
+            # Light sensor related parameters
+            self.light_sensor_b_adaptive = config["light_sensor"].get("adaptive", False)
+            self.light_sensor = BH1750(
+                mode      =bh1750.ONE_TIME_LORES if self.light_sensor_b_adaptive else bh1750.CONTINUOUS_HIRES_MODE,
+                lux_max   =config["light_sensor"]["shut_down_at_lux"],
+                lux_dark  =config["light_sensor"].get("dark_at_lux", 10),
+                mtreg_dark=config["light_sensor"].get("dark_mtreg", bh1750.MTREG_DEFAULT))
+            if config["light_sensor"].get("calibration"):
+                self.light_sensor.calibration = Calibration(
+                    path     =config["light_sensor"]["calibration"],
+                    lux_max  =self.light_sensor.lux_max,
+                    cache_dir=config["light_sensor"].get("calibration_cache", "~/.cache/floorlight"))
+
+            # Time-of-day scenes (brightness caps, ramp times, timeouts)
+            self.scenes = None
+            if config.get("scenes", {}).get("enabled", False):
+                self.scenes = SceneSchedule(config["scenes"])
+                self.scenes.get_scene()
+                self.scenes.print_timeline()
+
+            # Coordination with neighbouring controllers (follow-me pre-ramps)
+            self.coordinator = None
+            self.wake = None  # Set on PIR changes and pre-ramps (coordination only)
+            config_coordination = config.get("coordination", {})
+            if config_coordination.get("enabled", False) and (
+                    config.get("closed_loop", {}).get("enabled", False)
+                    or not config.get("motion_events", {}).get("enabled", False)):
+                # Only the hysteresis loop publishes motion and pre-ramps
+                print("Warning: coordination needs motion_events.enabled and closed_loop disabled, "
+                      "coordination is disabled.")
+            elif config_coordination.get("enabled", False):
+                self.wake = threading.Event()
+                if self.motion is not None:
+                    self.motion.add_handler(lambda pin, level, tick: self.wake.set())
+                else:
+                    self.pir.when_motion    = self.wake.set
+                    self.pir.when_no_motion = self.wake.set
+                self.coordinator = Coordinator(
+                    name    =config_coordination.get("name") or socket.gethostname(),
+                    position=config_coordination.get("position", 0),
+                    bus_dir =config_coordination.get("bus_dir", "/tmp/floorlight-bus"),
+                    reach   =config_coordination.get("reach", 1.0),
+                    window  =config_coordination.get("window", 5.0),
+                    wake    =self.wake)
             time.sleep(1)
         except Exception as e:
             print(f"Error initializing MotionSensor: {e}")
@@ -53,10 +136,82 @@ class LEDControl:
     # Private Helper Methods
     #########################################################
 
+    def _read_lux(self) -> float:
+        """Read lux either adaptive (one-shots, sensor powered down in
+        between) or in the configured continuous mode."""
+        if self.light_sensor_b_adaptive:
+            lux = self.light_sensor.read_lux_adaptive()
+        else:
+            lux = self.light_sensor.read_lux()
+        self._record_lux(lux)
+        return lux
+
+    def _record_lux(self, lux) -> None:
+        """Record the last lux reading in the state file."""
+        if self.state is not None and lux is not None:
+            self.state.set_lux(lux)
+
+    def _reload_calibration(self) -> None:
+        """Pick up changes of the calibration file."""
+        if self.light_sensor.calibration is not None:
+            self.light_sensor.calibration.maybe_reload()
+
+    def _lux_to_duty_cycle(self, lux) -> float:
+        """Map a lux reading to the duty cycle of the LED, picking up
+        changes of the calibration file."""
+        self._reload_calibration()
+        return self.light_sensor.lux_to_duty_cycle(lux)
+
+    def _read_duty_cycle(self) -> float:
+        """Read the light level and map it to the duty cycle of the LED,
+        picking up changes of the calibration file."""
+        if self.light_sensor_b_adaptive:
+            return self._lux_to_duty_cycle(self._read_lux())
+        self._reload_calibration()
+        duty = self.light_sensor.read_duty_cycle()
+        self._record_lux(self.light_sensor.lux_last)
+        return duty
+
+    def _resume_led(self) -> float:
+        """Restore the duty cycle of the previous run from the state file,
+        without a ramp. Only done once, at the start of a loop.
+        Returns:
+            float: Resumed duty cycle of LED A, 0 if there is nothing to resume.
+        """
+        if self.resume is None:
+            return 0
+        duty = self.resume["duty"].get(self.led_pin_a, 0.0)
+        self.resume = None
+        if duty <= 0:
+            return 0
+        print("Resuming at duty cycle {:.1f}% from the state file.".format(duty))
+        self.led.set_duty_ab(duty)
+        return duty
+
+    def _update_accounting(self) -> None:
+        """Account an ongoing on-period at least every accounting_T_update
+        seconds, PWM writes only account when the duty cycle changes."""
+        if self.accounting is None:
+            return
+        t_now = time.monotonic()
+        if t_now - self._t_accounting >= self.accounting_T_update:
+            self.accounting.update()
+            self._t_accounting = t_now
+
+    def _apply_scene(self):
+        """Look up the active scene and apply its ramp time.
+        Returns:
+            Scene: Active scene, None if scenes are disabled.
+        """
+        if self.scenes is None:
+            return None
+        scene = self.scenes.get_scene()
+        self.led.set_T_ramp(self.led_T_ramp if scene.T_ramp is None else scene.T_ramp)
+        return scene
+
     def _wait_for_settled_pir(self) -> None:
-        # Loop until PIR output is 0
-        while self.pir.motion_detected:
-            time.sleep(0.1)
+        # Block until PIR output is 0
+        self.pir.wait_for_no_motion()
 
 
     #########################################################
@@ -69,7 +224,7 @@ class LEDControl:
         """
         if self.pir.motion_detected:
             # Measure light level
-            lux = self.light_sensor.read_lux()
+            lux = self._read_lux()
             print("Motion detected at lux value: {:.4f}".format(lux))
             if b_led_is_on == False:                
                 self.led.ramp_ab( # Ramp up the LED strip
@@ -99,41 +254,230 @@ class LEDControl:
         This method handles KeyboardInterrupt to allow clean exit via
         Ctrl-C. It uses GPIO.wait_for_edge which blocks efficiently.
         """
+        b_shutdown = False
         try:
-            b_led_is_on = False
+            b_led_is_on = self._resume_led() > 0
             while True:
                 b_led_is_on = self.light_on_motion(duty_start, duty_end, timeout, b_led_is_on=b_led_is_on, b_print_led=b_print_led)
+                self._update_accounting()
                 time.sleep(0.1)
         except KeyboardInterrupt:
             print("Program interrupted by user.")
+            b_shutdown = True
         finally:
-            self.close()
+            self.close(b_shutdown=b_shutdown)
 
     def light_on_motion_lux_loop(self, duty_start=0, duty_end=40, timeout=4.0, b_led_is_on=False, b_print_led=True) -> None:
+        b_shutdown = False
         try:
-            b_led_is_on = False
+            duty_end_dynamic = self._resume_led()
+            b_led_is_on = duty_end_dynamic > 0
+            timeout_scene = timeout
             while True:
                 if not b_led_is_on:
-                    duty_end_dynamic = self.light_sensor.lux_to_duty_cycle(self.light_sensor.read_lux())
+                    duty_end_dynamic = self._read_duty_cycle()
+                    scene = self._apply_scene()
+                    if scene is not None:
+                        duty_end_dynamic = scene.clamp(duty_end_dynamic)
+                        timeout_scene = scene.get_timeout(timeout)
                     print("####### LED is off. Based on lux Dynamic duty_end:", duty_end_dynamic)
-                b_led_is_on = self.light_on_motion(duty_start, duty_end_dynamic, timeout, b_led_is_on=b_led_is_on, b_print_led=b_print_led)
+                b_led_is_on = self.light_on_motion(duty_start, duty_end_dynamic, timeout_scene, b_led_is_on=b_led_is_on, b_print_led=b_print_led)
+                self._update_accounting()
                 time.sleep(0.1)
         except KeyboardInterrupt:
             print("Program interrupted by user.")
+            b_shutdown = True
+        finally:
+            self.close(b_shutdown=b_shutdown)
+
+    def light_on_motion_hysteresis_loop(self, duty_start=0, b_print_led=False) -> None:
+        """
+        Turn the LED strip on and off through the MotionHysteresis engine
+        (config section "motion_events"): bursts of PIR edges are coalesced,
+        re-triggers extend the on time and a min. off time is enforced, so a
+        noisy PIR does not cause repeated ramps. Blocks on the PIR events
+        with the next engine timeout instead of polling.
+
+        With coordination enabled, every motion is published to the
+        neighbours and a pre-ramp requested by a neighbour turns the LED on
+        for pre_hold seconds; own motion then extends the on time as usual.
+        While waiting for motion, the loop blocks on a wake event which is
+        set by the PIR and by the coordinator, so it does not poll.
+        """
+        cfg = self.config["motion_events"]
+        engine = MotionHysteresis(
+                coalesce=cfg.get("coalesce", 0.5),
+                hold_on =cfg.get("hold_on", 30.0),
+                extend  =cfg.get("extend", 15.0),
+                min_off =cfg.get("min_off", 3.0))
+        config_coordination = self.config.get("coordination", {})
+        pre_hold = config_coordination.get("pre_hold", 10.0)
+        hold_on  = engine.hold_on
+        scene    = None
+        b_motion = False
+        duty_end = self._resume_led()
+        if duty_end > 0:
+            engine.set_on(time.monotonic())
+        b_shutdown = False
+        try:
+            while True:
+                self._update_accounting()
+                t_now = time.monotonic()
+                if not engine.b_on:
+                    # Apply the scene before the engine turns on, so its
+                    # timeout already holds for this activation
+                    scene = self._apply_scene()
+                    if scene is not None:
+                        engine.hold_on = scene.get_timeout(hold_on)
+                b_motion_now = self.pir.motion_detected
+                if b_motion_now != b_motion:
+                    b_motion = b_motion_now
+                    if b_motion and self.coordinator is not None:
+                        self.coordinator.publish_motion(t_now)
+                    action = engine.feed(t_now, b_motion)
+                else:
+                    action = engine.poll(t_now)
+
+                if self.coordinator is not None:
+                    t_edge = self.coordinator.take_pre_ramp()
+                    if t_edge is not None and action is None and not engine.b_on:
+                        duty_end = self._read_duty_cycle()
+                        if scene is not None:
+                            duty_end = scene.clamp(duty_end)
+                        if duty_end > 0:
+                            print("Neighbour motion. Pre-ramping to duty cycle {}%".format(duty_end))
+                            self.coordinator.record_pre_ramp(t_edge)
+                            self.led.ramp_ab(duty_start=duty_start, duty_end=duty_end, b_print=b_print_led)
+                            engine.set_on(time.monotonic(), hold_on=pre_hold)
+
+                if action == motionevents.ON:
+                    duty_end = self._read_duty_cycle()
+                    if scene is not None:
+                        duty_end = scene.clamp(duty_end)
+                    print("Motion detected. Ramping up to duty cycle {}%".format(duty_end))
+                    self.led.ramp_ab(duty_start=duty_start, duty_end=duty_end, b_print=b_print_led)
+                elif action == motionevents.OFF:
+                    print("Turning off LED due to no motion.")
+                    self.led.ramp_ab(duty_start=duty_end, duty_end=duty_start, b_print=b_print_led)
+                    duty_end = 0
+                    engine.print_stats()
+
+                # Block until the next PIR change or engine timeout
+                timeout = engine.time_to_next(time.monotonic())
+                if engine.b_on and self.accounting is not None:
+                    # Wake up for the accounting of a long on-period
+                    timeout = self.accounting_T_update if timeout is None else min(timeout, self.accounting_T_update)
+                if b_motion:
+                    self.pir.wait_for_no_motion(timeout=timeout)
+                elif self.wake is not None:
+                    # Own motion or a neighbour's pre-ramp. Cleared before the
+                    # states are read again at the top of the loop.
+                    self.wake.wait(timeout)
+                    self.wake.clear()
+                else:
+                    self.pir.wait_for_motion(timeout=timeout)
+        except KeyboardInterrupt:
+            print("Program interrupted by user.")
+            b_shutdown = True
         finally:
-            self.close()
+            engine.print_stats()
+            self.close(b_shutdown=b_shutdown)
 
-    def close(self) -> None:
+    def light_on_motion_closed_loop(self, duty_start=0, timeout=4.0, b_print_led=False) -> None:
+        """
+        Turn on the LED strip on motion detection and hold the target lux of
+        the "closed_loop" config section with a PI controller, until there
+        was no motion for timeout seconds. The initial ramp goes to the
+        open-loop lux_to_duty_cycle estimate, the closed loop starts bumpless
+        from there and reacts to daylight changes and the LEDs' own light.
+        After a restart, the duty cycle and the controller integrator are
+        resumed from the state file (the integrator only if it was recorded
+        for the same target lux).
+        """
+        stream = LuxStream(self._read_lux, T_min=self.config["closed_loop"].get("lux_period", 0.2))
+        stream.start()
+        stream.wait_for_first()
+        loop = ClosedLoopLux(self.led, stream, self.config)
+        loop.state = self.state
+        duty_min = loop.controller.out_min
+        duty_max = loop.controller.out_max
+        t_motion = [time.monotonic()]
+        timeout_scene = [timeout]
+
+        def b_motion_within_timeout():
+            self._update_accounting()
+            if self.pir.motion_detected:
+                t_motion[0] = time.monotonic()
+            return time.monotonic() - t_motion[0] < timeout_scene[0]
+
+        resume = self.resume
+        duty_resumed = self._resume_led()
+        integral = None
+        if duty_resumed > 0 and resume["target_lux"] == loop.target_lux:
+            integral = resume["integral"]
+        b_shutdown = False
+        try:
+            while True:
+                if duty_resumed > 0:
+                    # Continue in closed loop from the resumed duty and
+                    # integrator, no ramp
+                    duty_end = duty_resumed
+                    duty_resumed = 0
+                else:
+                    integral = None
+                    self.pir.wait_for_motion()
+                    duty_end = self._lux_to_duty_cycle(stream.lux)
+                    scene = self._apply_scene()
+                    if scene is not None:
+                        duty_end = scene.clamp(duty_end)
+                        loop.controller.out_min = scene.clamp(duty_min)
+                        loop.controller.out_max = scene.clamp(duty_max)
+                        timeout_scene[0] = scene.get_timeout(timeout)
+                    if duty_end == 0:
+                        # Bright enough, do not turn on
+                        self._wait_for_settled_pir()
+                        continue
+                    self.led.ramp_ab(duty_start=duty_start, duty_end=duty_end, b_print=b_print_led)
+                loop.start(duty_end, integral=integral)
+                t_motion[0] = time.monotonic()
+                loop.run(b_continue=b_motion_within_timeout)
+                print("Turning off LED due to no motion.")
+                loop.print_stats()
+                self.led.ramp_ab(duty_start=self.led.duty, duty_end=duty_start, b_print=b_print_led)
+        except KeyboardInterrupt:
+            print("Program interrupted by user.")
+            b_shutdown = True
+        finally:
+            stream.stop()
+            self.close(b_shutdown=b_shutdown)
+
+    def close(self, b_shutdown=True) -> None:
         """Cleanup only the pin used by this sensor.
 
         We avoid calling GPIO.cleanup() without arguments because that
         might remove other pins used by the program. Cleanup only the
         sensor pin for safety.
+
+        The state file is only zeroed on a deliberate shutdown (b_shutdown,
+        e.g. Ctrl-C). After an error it keeps the last duty cycles, so the
+        restarted service resumes the light instead of ramping from zero.
         """
         try:
+            if not b_shutdown:
+                self.led.state = None
             self.pir.close()
+            if self.motion is not None:
+                self.motion.print_latency_stats()
+                self.motion.close()
+            if self.coordinator is not None:
+                self.coordinator.print_stats()
+                self.coordinator.close()
             self.led.close()
-            self.light_sensor.power_down()
+            if self.accounting is not None:
+                self.accounting.close()
+            self.light_sensor.close()
+            if self.state is not None:
+                self.state.close()
         except Exception:
             # best-effort cleanup; ignore errors
             pass
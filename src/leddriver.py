@@ -0,0 +1,297 @@
+'''
+Project:    Pi Floor Light
+
+File:       src/leddriver.py
+
+Title:      LED Driver Protocol and Ramp Engine
+
+Abstract:   This module provides the backend independent part of the LED control: the
+            LedDriver protocol which every PWM backend implements, the DriverCapabilities
+            each backend declares, the RampEngine which plans and runs brightness ramps, and
+            the LedPair which drives two LED channels (B follows A by duty_b_factor).
+
+            Duty cycles are always given in percent (0..100); every driver converts them to
+            its native range. The backends live next to their library:
+
+                led_pigpio.PigpioDriver    pigpio hardware PWM (pigpiod)
+                led.RPiGPIODriver          RPi.GPIO software PWM
+
+            The RampEngine picks the step count and step time of a ramp from the capabilities
+            of the backend: as many steps as the duty resolution provides, but no step shorter
+            than the backend can apply glitch-free (one PWM period with hardware timing, two
+            without), than the writes of one step take (one call with batching, one per
+            channel without, at the measured write time), or than T_STEP_MIN. Steps are
+            scheduled on absolute deadlines, so the write time does not stretch the ramp.
+
+Author:     Dr. Oliver Opalko
+
+Email:      oliver.opalko@gmail.com
+
+'''
+#!/usr/bin/env python3
+import math
+import time
+from typing import Iterable, Protocol, Tuple
+
+######################################################################################################
+# Constants
+######################################################################################################
+
+DUTY_MIN    = 0.0
+DUTY_MAX    = 100.0
+T_STEP_MIN  = 0.01   # Steps faster than 100 Hz are not visible in a ramp (seconds)
+EMA_WRITE   = 0.1    # Smoothing factor of the measured write time
+
+######################################################################################################
+# Driver Protocol
+######################################################################################################
+class DriverCapabilities:
+    """Capabilities of a PWM backend.
+
+    Parameters:
+        name (str): Name of the backend.
+        resolution (int): Number of distinct duty steps between 0 and 100%.
+        b_hardware_timing (bool): PWM is timed by hardware (no jitter, duty applied per period).
+        b_batching (bool): Several channels can be written with one call.
+        b_waveforms (bool): The backend supports DMA timed waveforms.
+        T_write (float): Typical time of a single duty write in seconds.
+    """
+    def __init__(self, name, resolution, b_hardware_timing, b_batching, b_waveforms, T_write):
+        self.name              = name
+        self.resolution        = resolution
+        self.b_hardware_timing = b_hardware_timing
+        self.b_batching        = b_batching
+        self.b_waveforms       = b_waveforms
+        self.T_write           = T_write
+
+    @property
+    def n_period_min(self):
+        """Min. number of PWM periods per ramp step for a glitch-free change."""
+        return 1 if self.b_hardware_timing else 2
+
+    def format(self):
+        return "{:<12} resolution: {:>8}  hw timing: {:<5}  batching: {:<5}  waveforms: {:<5}  T_write: {:.0f} us".format(
+            self.name, self.resolution, str(self.b_hardware_timing), str(self.b_batching),
+            str(self.b_waveforms), 1e6 * self.T_write)
+
+# Capability matrix of the backends (see led_pigpio.PigpioDriver and led.RPiGPIODriver)
+PIGPIO = DriverCapabilities(
+        name              ="pigpio",
+        resolution        =1000000,  # Hardware PWM duty range of pigpiod (up to 250 Hz fully usable)
+        b_hardware_timing =True,
+        b_batching        =False,    # One hardware_PWM call per pin
+        b_waveforms       =False,    # DMA waveforms (wave_*) do not work on the hardware PWM pins
+        T_write           =0.0003)   # pigpiod round trip of one call (Pi Zero)
+RPI_GPIO = DriverCapabilities(
+        name              ="RPi.GPIO",
+        resolution        =100,      # Software PWM jitter makes steps below 1% invisible
+        b_hardware_timing =False,
+        b_batching        =False,
+        b_waveforms       =False,
+        T_write           =0.00005)  # ChangeDutyCycle call (Pi Zero)
+CAPABILITIES = {caps.name: caps for caps in (PIGPIO, RPI_GPIO)}
+
+class LedDriver(Protocol):
+    """Interface of a PWM backend. Duty cycles in percent."""
+    capabilities: DriverCapabilities
+
+    def set_duty(self, pin: int, duty: float) -> None:
+        """Set the duty cycle of a single pin."""
+        ...
+
+    def set_duties(self, duties: Iterable[Tuple[int, float]]) -> None:
+        """Set the duty cycles of several pins, in one call if the backend batches."""
+        ...
+
+    def close(self) -> None:
+        """Stop the PWM of all pins and release the backend."""
+        ...
+
+######################################################################################################
+# Ramp Engine
+######################################################################################################
+class RampEngine:
+    """Plans and runs ramps against the capabilities of a driver.
+
+    Parameters:
+        capabilities (DriverCapabilities): Capabilities of the backend.
+        T_ramp (float): Ramp time in seconds for the full range (0-100%).
+        f_pwm (float): PWM frequency in Hz.
+    """
+    def __init__(self, capabilities, T_ramp, f_pwm):
+        self.capabilities = capabilities
+        self.T_ramp       = T_ramp
+        self.f_pwm        = f_pwm
+        self.T_write_ema  = capabilities.T_write  # Measured time of one write call
+
+    def _get_n_write(self, n_channel):
+        """Number of driver calls per step."""
+        return 1 if self.capabilities.b_batching else n_channel
+
+    def plan(self, duty_start, duty_end, n_channel=2):
+        """Plan a ramp of n_channel channels. The ramp time is proportional
+        to the duty range, so small ramps at low duty cycles are short and
+        do not flicker.
+        Returns:
+            dict: Step count, step time, ramp time and strategy.
+        """
+        caps = self.capabilities
+        d_duty = abs(duty_end - duty_start)
+        T = self.T_ramp * d_duty / DUTY_MAX
+        n_write = self._get_n_write(n_channel)
+        T_step_min = max(T_STEP_MIN, caps.n_period_min / self.f_pwm, n_write * self.T_write_ema)
+        n_resolution = math.ceil(d_duty * caps.resolution / DUTY_MAX)
+        n_time = int(T / T_step_min)
+        n_step = max(1, min(n_resolution, n_time))
+        return {
+            "n_step":   n_step,
+            "T_step":   T / n_step,
+            "T_ramp":   T,
+            "strategy": "{}, {}, {}".format(
+                "hardware timed" if caps.b_hardware_timing else "software timed",
+                "batched" if caps.b_batching else "{} write{} per step".format(n_write, "s" if n_write > 1 else ""),
+                "resolution limited" if n_resolution <= n_time else "time limited"),
+        }
+
+    def ramp(self, duty_start, duty_end, write, b_print=False, n_channel=2):
+        """Ramp from duty_start to duty_end, calling write(duty) per step
+        (which writes n_channel channels).
+        Returns:
+            dict: The plan of the ramp.
+        """
+        plan = self.plan(duty_start, duty_end, n_channel)
+        n_write = self._get_n_write(n_channel)
+        n_step = plan["n_step"]
+        T_step = plan["T_step"]
+        if b_print:
+            print("Ramping from {}% to {}% in {:.2f} s: {} steps of {:.1f} ms ({}, {})".format(
+                duty_start, duty_end, plan["T_ramp"], n_step, 1e3 * T_step,
+                self.capabilities.name, plan["strategy"]))
+        # Step i is written at t_start + i*T_step, the start duty is already set
+        d_duty = (duty_end - duty_start) / n_step
+        t_next = time.monotonic()
+        for i in range(1, n_step + 1):
+            duty = duty_end if i == n_step else duty_start + i * d_duty
+            t_next += T_step
+            t_write = time.monotonic()
+            if t_next > t_write:
+                time.sleep(t_next - t_write)
+                t_write = time.monotonic()
+            write(duty)
+            T_write = (time.monotonic() - t_write) / n_write
+            self.T_write_ema += EMA_WRITE * (T_write - self.T_write_ema)
+        return plan
+
+######################################################################################################
+# LED Pair Control
+######################################################################################################
+class LedPair:
+    """Class for controlling a pair of LEDs via PWM on two GPIO pins with any
+    LedDriver backend. The duty cycle controls the brightness of the LEDs,
+    LED B follows LED A by duty_b_factor.
+
+    Parameters:
+        driver (LedDriver): PWM backend.
+        config (dict): Configuration, sections "led" and "pwm" are used.
+        duty_b_factor (float): Factor to determine duty cycle for LED B relative to LED A.
+    """
+    def __init__(self, driver, config: dict, duty_b_factor=1/2):
+        # Public attributes
+        self.driver        = driver
+        self.pin_a         = config["led"]["pin_a"]
+        self.pin_b         = config["led"]["pin_b"]
+        self.T_ramp        = config["led"]["T_ramp"]
+        self.duty_b_factor = self._clamp_duty_b_factor(duty_b_factor)
+        self.f_pwm         = config["pwm"]["frequency"]  # 200 Hz is a good default
+        self.duty          = 0.0  # Duty cycle of LED A (percent)
+        self.duty_b        = 0.0  # Duty cycle of LED B (percent)
+        self.state         = None # Optional statefile.StateFile, updated on every PWM write
+        self.accounting    = None # Optional accounting.EnergyAccounting, fed by every PWM write
+        self.ramp_engine   = RampEngine(driver.capabilities, self.T_ramp, self.f_pwm)
+
+    #########################################################
+    # Private Helper Methods
+    #########################################################
+    def _clamp_duty_b_factor(self, duty_b_factor):
+        """ Clamp duty_b_factor to be within [0.001, 1.0].
+        Returns:
+            float: Clamped duty_b_factor.
+        """
+        if duty_b_factor < 0.001:
+            return 0.001
+        elif duty_b_factor > 1.0:
+            return 1.0
+        return duty_b_factor
+
+    def _write(self, duty_a, duty_b):
+        """Write the duty cycles (percent) of LED A and B. Only changed
+        channels are written. Every write is recorded in the state file
+        and the energy accounting."""
+        if duty_a != self.duty and duty_b != self.duty_b:
+            self.driver.set_duties(((self.pin_a, duty_a), (self.pin_b, duty_b)))
+        elif duty_a != self.duty:
+            self.driver.set_duty(self.pin_a, duty_a)
+        elif duty_b != self.duty_b:
+            self.driver.set_duty(self.pin_b, duty_b)
+        else:
+            return
+        self.duty   = duty_a
+        self.duty_b = duty_b
+        if self.state is not None:
+            self.state.set_duty(self.pin_a, duty_a, self.pin_b, duty_b)
+        if self.accounting is not None:
+            self.accounting.set_duty(self.pin_a, duty_a, self.pin_b, duty_b)
+
+    def _write_ab(self, duty_a):
+        self._write(duty_a, duty_a * self.duty_b_factor)
+
+    #########################################################
+    # Public Methods
+    #########################################################
+
+    def ramp_a(self, duty_start, duty_end, b_print=True):
+        """Ramp LED A from duty_start to duty_end, LED B stays."""
+        return self.ramp_engine.ramp(duty_start, duty_end, lambda duty: self._write(duty, self.duty_b), b_print=b_print, n_channel=1)
+
+    def ramp_b(self, duty_start, duty_end, b_print=True):
+        """Ramp LED B from duty_start to duty_end, LED A stays."""
+        return self.ramp_engine.ramp(duty_start, duty_end, lambda duty: self._write(self.duty, duty), b_print=b_print, n_channel=1)
+
+    def ramp_ab(self, duty_start, duty_end, b_print=True):
+        """Ramp both LEDs from duty_start to duty_end (LED B scaled by duty_b_factor).
+        Returns:
+            dict: The plan of the ramp (see RampEngine.plan).
+        """
+        return self.ramp_engine.ramp(duty_start, duty_end, self._write_ab, b_print=b_print)
+
+    def set_duty_ab(self, duty):
+        """Set LED A to duty (percent) and LED B to duty*duty_b_factor without
+        ramping. Used by the closed-loop controller."""
+        self._write_ab(duty)
+
+    def set_T_ramp(self, T_ramp):
+        """Change the ramp time (seconds for the full range) of the next ramps."""
+        self.T_ramp = T_ramp
+        self.ramp_engine.T_ramp = T_ramp
+
+    def set_pwm_a(self, duty_cycle_a):
+        """Set the duty cycle (percent) of LED A."""
+        self._write(duty_cycle_a, self.duty_b)
+
+    def set_pwm_b(self, duty_cycle_b):
+        """Set the duty cycle (percent) of LED B."""
+        self._write(self.duty, duty_cycle_b)
+
+    def close(self):
+        """Turn off both LEDs and release the driver."""
+        try:
+            self._write(DUTY_MIN, DUTY_MIN)
+        finally:
+            self.driver.close()
+
+    # Method for printing the info of the LED pair
+    def print_info(self):
+        print("LED Pin A:", self.pin_a)
+        print("LED Pin B:", self.pin_b)
+        print("PWM Frequency:", self.f_pwm)
+        print("Driver:", self.driver.capabilities.format())
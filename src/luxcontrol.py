@@ -0,0 +1,319 @@
+'''
+Project:    Pi Floor Light
+
+File:       src/luxcontrol.py
+
+Title:      Closed-Loop Illuminance Control
+
+Abstract:   This module provides a closed-loop controller which holds a target illuminance
+            (lux) at the light sensor. A background thread streams lux readings from the
+            BH1750, and a PI controller running at a fixed rate adjusts the duty cycle of
+            the LedPair. In contrast to the open-loop lux_to_duty_cycle mapping, the loop
+            reacts to changing daylight and compensates for the light of the LEDs themselves
+            reaching the sensor.
+
+            The PWM output is rate limited (max. duty change per second) and only written
+            when the quantized duty cycle changes, which keeps the number of pigpio calls
+            low. Per tick the loop does a handful of float operations and no allocations,
+            so it can run continuously on a Pi Zero.
+
+Author:     Dr. Oliver Opalko
+
+Email:      oliver.opalko@gmail.com
+
+'''
+#!/usr/bin/env python3
+import time
+import threading
+
+######################################################################################################
+# Constants
+######################################################################################################
+
+DUTY_MIN      = 0.0
+DUTY_MAX      = 100.0
+DUTY_QUANTUM  = 0.1   # Smallest duty change (percent) that is written to the LEDs
+SETTLE_HOLD   = 1.0   # Error must stay within the settle band this long (seconds)
+
+######################################################################################################
+# Background Lux Stream
+######################################################################################################
+class LuxStream(threading.Thread):
+    """Background thread which reads the light sensor as fast as it delivers
+    and keeps the latest value. The control loop never blocks on I2C.
+
+    Parameters:
+        read_lux (callable): Function returning the current lux value, e.g. BH1750.read_lux.
+        T_min (float): Min. time between two reads in seconds.
+    """
+    def __init__(self, read_lux, T_min=0.0):
+        super().__init__(daemon=True)
+        self.read_lux = read_lux
+        self.T_min    = T_min
+        self.lux      = None  # Latest lux value, None until the first read
+        self.t_lux    = 0.0   # time.monotonic() of the latest read
+        self.n_read   = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            t_start = time.monotonic()
+            try:
+                lux = self.read_lux()
+            except OSError as e:
+                # I2C hiccup: keep the last value and retry
+                print(f"Error reading lux: {e}")
+                self._stop_event.wait(0.1)
+                continue
+            # Single attribute assignments are atomic, no lock needed
+            self.lux   = lux
+            self.t_lux = time.monotonic()
+            self.n_read += 1
+            T_wait = self.T_min - (self.t_lux - t_start)
+            if T_wait > 0:
+                self._stop_event.wait(T_wait)
+
+    def wait_for_first(self, timeout=2.0):
+        """Block until the first lux value is available.
+        Returns:
+            bool: True if a value is available.
+        """
+        t_end = time.monotonic() + timeout
+        while self.lux is None and time.monotonic() < t_end:
+            time.sleep(0.01)
+        return self.lux is not None
+
+    def stop(self):
+        self._stop_event.set()
+
+######################################################################################################
+# PI Controller
+######################################################################################################
+class PIController:
+    """Discrete PI controller with output clamping and anti-windup.
+
+    Parameters:
+        kp (float): Proportional gain (duty percent per lux).
+        ki (float): Integral gain (duty percent per lux and second).
+        out_min (float): Min. output (duty percent).
+        out_max (float): Max. output (duty percent).
+    """
+    def __init__(self, kp, ki, out_min=DUTY_MIN, out_max=DUTY_MAX):
+        self.kp       = kp
+        self.ki       = ki
+        self.out_min  = out_min
+        self.out_max  = out_max
+        self.integral = 0.0
+
+    def reset(self, output=0.0):
+        """Reset the integrator so that the next output starts at output
+        (bumpless transfer from a ramp to the closed loop)."""
+        self.integral = min(self.out_max, max(self.out_min, output))
+
+    def update(self, error, dt):
+        """Calculate the new output for the control error (setpoint - measurement).
+        Returns:
+            float: Clamped output.
+        """
+        integral = self.integral + self.ki * error * dt
+        output = integral + self.kp * error
+        # Anti-windup: only integrate while the output is not saturated
+        # in the direction of the error
+        if output > self.out_max:
+            output = self.out_max
+            if error < 0:
+                self.integral = integral
+        elif output < self.out_min:
+            output = self.out_min
+            if error > 0:
+                self.integral = integral
+        else:
+            self.integral = integral
+        return output
+
+######################################################################################################
+# Closed-Loop Lux Control
+######################################################################################################
+class ClosedLoopLux:
+    """Fixed-rate PI control loop which holds target_lux at the light sensor.
+
+    Parameters:
+        led (LedPair): LED pair, needs set_duty_ab(duty) and a duty attribute.
+        stream (LuxStream): Background lux stream.
+        config (dict): Configuration, section "closed_loop" is used.
+    """
+    def __init__(self, led, stream, config: dict):
+        cfg = config["closed_loop"]
+        # Public attributes
+        self.led          = led
+        self.stream       = stream
+        self.target_lux   = float(cfg["target_lux"])
+        self.rate_hz      = float(cfg["rate_hz"])
+        self.slew         = float(cfg["slew"])  # Max. duty change in percent per second
+        self.settle_band  = float(cfg.get("settle_band_lux", 5))
+        self.state        = None  # Optional statefile.StateFile for the controller state
+        self.controller   = PIController(
+                kp      =float(cfg["kp"]),
+                ki      =float(cfg["ki"]),
+                out_min =float(cfg.get("duty_min", 1)),
+                out_max =float(cfg.get("duty_max", DUTY_MAX)))
+
+        # Private attributes
+        self._T_tick     = 1.0 / self.rate_hz
+        self._duty       = led.duty  # Rate limited duty (not quantized)
+        self._t_settle_ref = time.monotonic()  # Start of the current settling measurement
+        self._t_in_band  = None
+
+        # Loop statistics
+        self.settling_time = None  # Seconds from the last setpoint change until settled
+        self.reset_stats()
+
+    #########################################################
+    # Private Helper Methods
+    #########################################################
+
+    def _update_settling(self, t_now, error):
+        """Track the time until |error| stays within settle_band for SETTLE_HOLD."""
+        if abs(error) <= self.settle_band:
+            if self._t_in_band is None:
+                self._t_in_band = t_now
+            elif self.settling_time is None and t_now - self._t_in_band >= SETTLE_HOLD:
+                self.settling_time = self._t_in_band - self._t_settle_ref
+        else:
+            self._t_in_band = None
+            if self.settling_time is not None:
+                # Disturbance (e.g. daylight change): measure the next settling
+                self.settling_time = None
+                self._t_settle_ref = t_now
+
+    #########################################################
+    # Public Methods
+    #########################################################
+
+    def reset_stats(self):
+        """Reset the loop timing statistics."""
+        self.n_tick      = 0
+        self.n_write     = 0
+        self.n_overrun   = 0
+        self.T_work_sum  = 0.0
+        self.T_work_max  = 0.0
+        self.jitter_max  = 0.0
+
+    def restart_settling(self):
+        """Restart the settling measurement from now, e.g. at a known
+        disturbance."""
+        self.settling_time = None
+        self._t_settle_ref = time.monotonic()
+        self._t_in_band = None
+
+    def set_target(self, target_lux):
+        """Change the setpoint and restart the settling measurement."""
+        self.target_lux = float(target_lux)
+        self.restart_settling()
+
+    def start(self, duty=None, integral=None):
+        """Prepare a bumpless start from the current (or given) duty. The
+        statistics start over, so print_stats() reports this on-period.
+        integral resumes the integrator of a previous run (state file)."""
+        if duty is None:
+            duty = self.led.duty
+        self.reset_stats()
+        self._duty = duty
+        self.controller.reset(duty if integral is None else integral)
+        self.set_target(self.target_lux)
+
+    def step(self, dt):
+        """One control tick: PI update, slew rate limit, quantized PWM write.
+        Returns:
+            float: Duty cycle (percent) of LED A after this tick.
+        """
+        lux = self.stream.lux
+        if lux is None:
+            return self._duty
+        error = self.target_lux - lux
+        duty_cmd = self.controller.update(error, dt)
+
+        # Rate limit the PWM change
+        d_max = self.slew * dt
+        if duty_cmd > self._duty + d_max:
+            self._duty += d_max
+        elif duty_cmd < self._duty - d_max:
+            self._duty -= d_max
+        else:
+            self._duty = duty_cmd
+
+        # Only write when the quantized duty changes
+        duty_q = round(self._duty / DUTY_QUANTUM) * DUTY_QUANTUM
+        if duty_q != self.led.duty:
+            self.led.set_duty_ab(duty_q)
+            self.n_write += 1
+            if self.state is not None:
+                self.state.set_controller(self.controller.integral, self.target_lux)
+        self._update_settling(time.monotonic(), error)
+        return duty_q
+
+    def run(self, b_continue=None, duration=None, b_print=False):
+        """Run the control loop at rate_hz until b_continue() returns False
+        or duration (seconds) has elapsed. Ticks are scheduled on absolute
+        deadlines, so the rate does not drift with the work time; missed
+        ticks are skipped and counted as overruns.
+        """
+        t_start = time.monotonic()
+        t_next  = t_start
+        t_last  = t_start
+        while True:
+            t_now = time.monotonic()
+            if duration is not None and t_now - t_start >= duration:
+                break
+            if b_continue is not None and not b_continue():
+                break
+            jitter = t_now - t_next
+            if jitter > self.jitter_max:
+                self.jitter_max = jitter
+
+            duty = self.step(t_now - t_last if self.n_tick else self._T_tick)
+            t_last = t_now
+
+            T_work = time.monotonic() - t_now
+            self.T_work_sum += T_work
+            if T_work > self.T_work_max:
+                self.T_work_max = T_work
+            self.n_tick += 1
+            if b_print:
+                print("lux: {}, duty: {:.1f}%".format(self.stream.lux, duty))
+
+            t_next += self._T_tick
+            t_now = time.monotonic()
+            if t_now > t_next:
+                # Overrun: skip the missed ticks instead of catching up
+                n_missed = int((t_now - t_next) / self._T_tick) + 1
+                self.n_overrun += n_missed
+                t_next += n_missed * self._T_tick
+            time.sleep(t_next - t_now)
+
+    def get_stats(self):
+        """Return loop timing and settling statistics.
+        Returns:
+            dict: Statistics of the control loop.
+        """
+        return {
+            "rate_hz":        self.rate_hz,
+            "n_tick":         self.n_tick,
+            "n_write":        self.n_write,
+            "n_overrun":      self.n_overrun,
+            "T_work_mean_us": 1e6 * self.T_work_sum / self.n_tick if self.n_tick else 0.0,
+            "T_work_max_us":  1e6 * self.T_work_max,
+            "jitter_max_ms":  1e3 * self.jitter_max,
+            "settling_time":  self.settling_time,
+        }
+
+    def print_stats(self):
+        stats = self.get_stats()
+        print("Closed loop @ {:.0f} Hz: {} ticks, {} PWM writes, {} overruns".format(
+            stats["rate_hz"], stats["n_tick"], stats["n_write"], stats["n_overrun"]))
+        print("Tick work time: mean {:.1f} us, max {:.1f} us, max jitter {:.2f} ms".format(
+            stats["T_work_mean_us"], stats["T_work_max_us"], stats["jitter_max_ms"]))
+        if stats["settling_time"] is None:
+            print("Settling time: not settled")
+        else:
+            print("Settling time: {:.2f} s".format(stats["settling_time"]))
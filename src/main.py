@@ -21,12 +21,20 @@ import time, math
 import utils
 import ledcontrol
 from led_pigpio import LedPair
+from profiling import Profiler
 # from gpiozero import MotionSensor
 
 def main():
 
     """Main function to initialize and control the LED strip via PWM."""
     config = utils.load_config("./config/static_config.yaml")
+
+    # Opt-in profiling hooks (SIGUSR1: cProfile window, SIGUSR2: memory and timers)
+    if config.get("profiling", {}).get("enabled", False):
+        profiler = Profiler(
+                out_dir=config["profiling"].get("out_dir", "/tmp/floorlight-profile"),
+                window =config["profiling"].get("window", 30.0))
+        profiler.install()
  
     # Load runtime configuration from config/settings.json (project root)
     duty_cycle = 5  # Duty cycle in percent
@@ -43,7 +51,12 @@ def main():
         # led.ramp_ab(duty_start, duty_end, b_print=True)
         # led.ramp_ab(duty_end, duty_start, b_print=True)
         
-        led_ctrl.light_on_motion_lux_loop()
+        if config.get("closed_loop", {}).get("enabled", False):
+            led_ctrl.light_on_motion_closed_loop()
+        elif config.get("motion_events", {}).get("enabled", False):
+            led_ctrl.light_on_motion_hysteresis_loop()
+        else:
+            led_ctrl.light_on_motion_lux_loop()
         print("LED control loop ended.")
     finally:
         # Cleanup
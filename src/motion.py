@@ -0,0 +1,273 @@
+'''
+Project:    Pi Floor Light
+
+File:       src/motion.py
+
+Title:      Edge-Callback Motion Input
+
+Abstract:   This module provides a motion input subsystem for any number of PIR sensors
+            which is built on pigpio edge callbacks instead of polling. pigpiod delivers
+            the edges of all pins over a single notification socket, and debounces them
+            in the daemon with its glitch filter. The edges are handed over to a single
+            dispatcher thread which updates the per-pin state and calls the handlers, so
+            a slow handler (e.g. a LED ramp) never blocks the event source.
+
+            For every edge the dispatch latency (edge tick in pigpiod to handler call) is
+            measured. The pigpio tick is mapped to time.monotonic() with an offset which
+            is synchronized at start and periodically while idle.
+
+            On a pigpioconn.ManagedPi, the levels of all pins are re-read after a reconnect
+            (edges while pigpiod was down are lost), and changed levels are dispatched like
+            edges, without a latency sample. The tick offset is synchronized again, since a
+            restarted daemon starts a new tick.
+
+            MotionPin offers the subset of the gpiozero MotionSensor interface which the
+            LEDControl uses (motion_detected, wait_for_motion, wait_for_no_motion, close),
+            so it can be used as a drop-in replacement. MotionInput.any is a MotionPin
+            which reports motion while any of the pins does, so all PIRs of a controller
+            can drive the same LEDs.
+
+Author:     Dr. Oliver Opalko
+
+Email:      oliver.opalko@gmail.com
+
+'''
+#!/usr/bin/env python3
+import time
+import queue
+import threading
+from collections import deque
+import pigpio
+
+######################################################################################################
+# Constants
+######################################################################################################
+
+TICK_MASK       = 0xFFFFFFFF  # pigpio ticks are unsigned 32 bit microseconds (wrap after ~72 min)
+T_CLOCK_SYNC    = 60.0        # Re-synchronize the tick offset after this idle time (seconds)
+N_LATENCY       = 1024        # Number of latency samples kept for percentiles
+DEBOUNCE_US     = 10000       # Default glitch filter (microseconds)
+
+######################################################################################################
+# Motion Pin
+######################################################################################################
+class MotionPin:
+    """State of a single PIR pin, updated by the MotionInput dispatcher.
+    Mirrors the used part of the gpiozero MotionSensor interface.
+    """
+    def __init__(self, motion_input, pin, level=0):
+        self.motion_input = motion_input
+        self.pin          = pin
+        self._motion      = threading.Event()
+        self._no_motion   = threading.Event()
+        self._set_level(level)
+
+    def _set_level(self, level):
+        if level:
+            self._no_motion.clear()
+            self._motion.set()
+        else:
+            self._motion.clear()
+            self._no_motion.set()
+
+    @property
+    def motion_detected(self):
+        return self._motion.is_set()
+
+    def wait_for_motion(self, timeout=None):
+        """Block until the PIR output is high.
+        Returns:
+            bool: True if motion was detected within timeout.
+        """
+        return self._motion.wait(timeout)
+
+    def wait_for_no_motion(self, timeout=None):
+        """Block until the PIR output is low.
+        Returns:
+            bool: True if the PIR settled within timeout.
+        """
+        return self._no_motion.wait(timeout)
+
+    def close(self):
+        if self.pin is not None:
+            self.motion_input.remove_pin(self.pin)
+
+######################################################################################################
+# Motion Input
+######################################################################################################
+class MotionInput:
+    """Edge-callback motion input for many PIR pins with a single event source.
+
+    Parameters:
+        pins (list): GPIO pins (BCM) of the PIR sensors.
+        debounce_us (int): pigpiod glitch filter in microseconds, 0 disables it.
+        pi (pigpio.pi): Existing pigpio connection to share, e.g. LedPair.pwm.
+    """
+    def __init__(self, pins, debounce_us=DEBOUNCE_US, pi=None):
+        self.pi = pi if pi is not None else pigpio.pi()
+        if not self.pi.connected:
+            raise RuntimeError("Keine Verbindung zu pigpiod – läuft der Daemon?")
+        self._b_own_pi    = pi is None
+        self.debounce_us  = debounce_us
+        self.sensors      = {}
+        self.handlers     = []
+        self.any          = MotionPin(self, None)  # Motion on any of the pins
+
+        # Private attributes
+        self._queue       = queue.SimpleQueue()
+        self._callbacks   = {}
+        self._lock        = threading.Lock()
+        self._tick_offset = 0  # time.monotonic() in us minus pigpio tick
+        self._t_synced    = 0.0
+
+        # Latency statistics (microseconds)
+        self.n_event         = 0
+        self.latency_sum_us  = 0
+        self.latency_max_us  = 0
+        self.latencies_us    = deque(maxlen=N_LATENCY)
+
+        self._sync_clock()
+        for pin in pins:
+            self.add_pin(pin)
+        if hasattr(self.pi, "add_reconnect_handler"):
+            self.pi.add_reconnect_handler(self._on_reconnect)
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self._dispatcher.start()
+
+    #########################################################
+    # Private Helper Methods
+    #########################################################
+
+    def _sync_clock(self):
+        """Estimate the offset between time.monotonic() and the pigpio tick.
+        The tick is taken in the middle of the round trip to pigpiod."""
+        t_0 = time.monotonic()
+        tick = self.pi.get_current_tick()
+        t_1 = time.monotonic()
+        self._tick_offset = int((t_0 + t_1) * 500000) - tick
+        self._t_synced = t_1
+
+    def _on_edge(self, pin, level, tick):
+        """pigpio callback (runs in the pigpio notification thread): hand the
+        edge over to the dispatcher and return immediately."""
+        self._queue.put((pin, level, tick))
+
+    def _on_reconnect(self):
+        """ManagedPi reconnect handler: re-read the levels of all pins and
+        dispatch the ones which changed while pigpiod was down."""
+        self._sync_clock()
+        for pin, sensor in list(self.sensors.items()):
+            level = self.pi.read(pin)
+            if bool(level) != sensor.motion_detected:
+                self._queue.put((pin, level, None))
+
+    def _dispatch_loop(self):
+        while True:
+            try:
+                event = self._queue.get(timeout=T_CLOCK_SYNC)
+            except queue.Empty:
+                self._sync_clock()
+                continue
+            if event is None:
+                break
+            pin, level, tick = event
+            if level == pigpio.TIMEOUT:
+                continue
+            sensor = self.sensors.get(pin)
+            if sensor is None:
+                continue
+            sensor._set_level(level)
+            self._update_any()
+            if tick is not None:
+                self._record_latency(tick)
+            for handler in self.handlers:
+                try:
+                    handler(pin, level, tick)
+                except Exception as e:
+                    print(f"Error in motion handler {handler}: {e}")
+            if time.monotonic() - self._t_synced > T_CLOCK_SYNC:
+                self._sync_clock()
+
+    def _update_any(self):
+        self.any._set_level(any(sensor.motion_detected for sensor in list(self.sensors.values())))
+
+    def _record_latency(self, tick):
+        tick_now = (int(time.monotonic() * 1000000) - self._tick_offset) & TICK_MASK
+        latency_us = (tick_now - tick) & TICK_MASK
+        if latency_us > TICK_MASK >> 1:
+            # Edge "after" now: offset estimate is off by a few us
+            latency_us = 0
+        self.n_event += 1
+        self.latency_sum_us += latency_us
+        if latency_us > self.latency_max_us:
+            self.latency_max_us = latency_us
+        self.latencies_us.append(latency_us)
+
+    #########################################################
+    # Public Methods
+    #########################################################
+
+    def add_pin(self, pin, b_input=True):
+        """Register a PIR pin: input with pull-down, glitch filter, edge callback.
+        Returns:
+            MotionPin: State object of the pin.
+        """
+        with self._lock:
+            if pin in self.sensors:
+                return self.sensors[pin]
+            if b_input:
+                self.pi.set_mode(pin, pigpio.INPUT)
+                self.pi.set_pull_up_down(pin, pigpio.PUD_DOWN)
+            if self.debounce_us:
+                self.pi.set_glitch_filter(pin, self.debounce_us)
+            sensor = MotionPin(self, pin, level=self.pi.read(pin))
+            self.sensors[pin] = sensor
+            self._callbacks[pin] = self.pi.callback(pin, pigpio.EITHER_EDGE, self._on_edge)
+            self._update_any()
+            return sensor
+
+    def remove_pin(self, pin):
+        """Cancel the callback and glitch filter of a pin."""
+        with self._lock:
+            callback = self._callbacks.pop(pin, None)
+            if callback is None:
+                return
+            callback.cancel()
+            if self.debounce_us:
+                self.pi.set_glitch_filter(pin, 0)
+            del self.sensors[pin]
+            self._update_any()
+
+    def add_handler(self, handler):
+        """Register handler(pin, level, tick), called in the dispatcher thread.
+        tick is None for a level which was re-read after a reconnect."""
+        self.handlers.append(handler)
+
+    def get_latency_stats(self):
+        """Return the dispatch latency statistics in microseconds.
+        Returns:
+            dict: n, mean, p50, p99 and max latency.
+        """
+        samples = sorted(self.latencies_us)
+        n = len(samples)
+        return {
+            "n_event":  self.n_event,
+            "mean_us":  self.latency_sum_us / self.n_event if self.n_event else 0.0,
+            "p50_us":   samples[n // 2] if n else 0,
+            "p99_us":   samples[min(n - 1, int(n * 0.99))] if n else 0,
+            "max_us":   self.latency_max_us,
+        }
+
+    def print_latency_stats(self):
+        stats = self.get_latency_stats()
+        print("Motion dispatch latency over {} edges: mean {:.0f} us, p50 {} us, p99 {} us, max {} us".format(
+            stats["n_event"], stats["mean_us"], stats["p50_us"], stats["p99_us"], stats["max_us"]))
+
+    def close(self):
+        """Cancel all callbacks and stop the dispatcher."""
+        for pin in list(self._callbacks):
+            self.remove_pin(pin)
+        self._queue.put(None)
+        self._dispatcher.join(timeout=1.0)
+        if self._b_own_pi:
+            self.pi.stop()
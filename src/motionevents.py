@@ -0,0 +1,213 @@
+'''
+Project:    Pi Floor Light
+
+File:       src/motionevents.py
+
+Title:      Motion Event Coalescing and Hysteresis
+
+Abstract:   This module provides an event-processing stage between the PIR input and the
+            LED actions. A noisy PIR produces bursts of edges, and every motion / no-motion
+            change would otherwise cost a full ramp_ab (~200 PWM writes, blocking for up to
+            T_ramp seconds). The MotionHysteresis engine turns the raw edges into ON/OFF
+            actions:
+
+                - Rising edges within the coalesce window of the previous one are merged.
+                - After the motion ended (falling edge), the LED stays on for hold_on seconds,
+                  however long the PIR pulse was; a re-trigger while on extends the
+                  off-deadline to at least extend seconds from now.
+                - After turning off, the LED stays off for at least min_off seconds. Motion
+                  within that window turns it on once the window has passed.
+
+            The engine is pure logic on explicit timestamps, so scripted edge streams can be
+            replayed without hardware (see replay()). It counts the ramps a naive controller
+            (one ramp up and one ramp down per PIR pulse) would have done and the ramps saved.
+
+Author:     Dr. Oliver Opalko
+
+Email:      oliver.opalko@gmail.com
+
+'''
+#!/usr/bin/env python3
+
+######################################################################################################
+# Constants
+######################################################################################################
+
+ON  = "on"
+OFF = "off"
+
+######################################################################################################
+# Motion Hysteresis
+######################################################################################################
+class MotionHysteresis:
+    """Turn PIR edges into ON/OFF actions with coalescing, hold-on time and
+    min. off time. All times in seconds, t is any monotonic clock.
+
+    Parameters:
+        coalesce (float): Rising edges within this window of the previous one are merged.
+        hold_on (float): Time the LED stays on after the motion ended.
+        extend (float): Min. remaining on time after a re-trigger while on.
+        min_off (float): Min. time the LED stays off after turning off.
+    """
+    def __init__(self, coalesce=0.5, hold_on=30.0, extend=15.0, min_off=3.0):
+        # Public attributes
+        self.coalesce = coalesce
+        self.hold_on  = hold_on
+        self.extend   = extend
+        self.min_off  = min_off
+        self.b_on     = False
+
+        # Private attributes
+        self._b_motion   = False  # Current PIR level
+        self._b_pending  = False  # Motion during min_off, turn on afterwards
+        self._t_rising   = None   # Time of the last rising edge
+        self._t_deadline = 0.0    # Turn off at this time (if no motion)
+        self._t_off      = None   # Time of the last turn off
+
+        # Statistics
+        self.n_edge      = 0
+        self.n_rising    = 0
+        self.n_coalesced = 0
+        self.n_ramp      = 0
+
+    #########################################################
+    # Private Helper Methods
+    #########################################################
+
+    def _turn_on(self, t):
+        self.b_on = True
+        self._b_pending = False
+        self._t_deadline = t + self.hold_on
+        self.n_ramp += 1
+        return ON
+
+    def _turn_off(self, t):
+        self.b_on = False
+        self._t_off = t
+        self.n_ramp += 1
+        return OFF
+
+    #########################################################
+    # Public Methods
+    #########################################################
+
+    def feed(self, t, level):
+        """Process a PIR edge (level 1: motion, 0: no motion) at time t.
+        Returns:
+            str: ON, OFF or None.
+        """
+        self.n_edge += 1
+        b_motion = bool(level)
+        if b_motion == self._b_motion:
+            return self.poll(t)
+        self._b_motion = b_motion
+        if not b_motion:
+            if self.b_on:
+                # Motion ended: the hold-on time starts now
+                self._t_deadline = max(self._t_deadline, t + self.hold_on)
+            return self.poll(t)
+
+        self.n_rising += 1
+        if self._t_rising is not None and t - self._t_rising < self.coalesce:
+            self.n_coalesced += 1
+            self._t_rising = t
+            return self.poll(t)
+        self._t_rising = t
+
+        if self.b_on:
+            # Re-trigger: extend the on time
+            self._t_deadline = max(self._t_deadline, t + self.extend)
+            return None
+        if self._t_off is not None and t - self._t_off < self.min_off:
+            self._b_pending = True
+            return None
+        return self._turn_on(t)
+
+    def set_on(self, t, hold_on=None):
+        """Mark the LED as on without an ON action, e.g. when the previous
+        duty cycle was resumed after a restart or a neighbour pre-ramped
+        it (hold_on: on time in seconds, None: the default hold_on)."""
+        self.b_on = True
+        self._b_pending = False
+        self._t_deadline = t + (self.hold_on if hold_on is None else hold_on)
+
+    def poll(self, t):
+        """Process timeouts at time t. Call regularly, at the latest after
+        time_to_next(t) seconds.
+        Returns:
+            str: ON, OFF or None.
+        """
+        if self.b_on:
+            if not self._b_motion and t >= self._t_deadline:
+                return self._turn_off(t)
+        elif self._b_pending and t >= self._t_off + self.min_off:
+            return self._turn_on(t)
+        return None
+
+    def time_to_next(self, t):
+        """Time until the next timeout which poll() has to handle.
+        Returns:
+            float: Seconds, None if no timeout is pending.
+        """
+        if self.b_on and not self._b_motion:
+            return max(0.0, self._t_deadline - t)
+        if not self.b_on and self._b_pending:
+            return max(0.0, self._t_off + self.min_off - t)
+        return None
+
+    def get_stats(self):
+        """Return edge and ramp statistics. A naive controller ramps up and
+        down once per rising edge.
+        Returns:
+            dict: Statistics of the engine.
+        """
+        n_ramp_naive = 2 * self.n_rising
+        return {
+            "n_edge":       self.n_edge,
+            "n_rising":     self.n_rising,
+            "n_coalesced":  self.n_coalesced,
+            "n_ramp":       self.n_ramp,
+            "n_ramp_naive": n_ramp_naive,
+            "n_ramp_saved": max(0, n_ramp_naive - self.n_ramp),
+        }
+
+    def print_stats(self):
+        stats = self.get_stats()
+        print("Motion events: {} edges, {} rising ({} coalesced), {} ramps vs. {} naive -> {} ramps saved".format(
+            stats["n_edge"], stats["n_rising"], stats["n_coalesced"],
+            stats["n_ramp"], stats["n_ramp_naive"], stats["n_ramp_saved"]))
+
+######################################################################################################
+# Scripted Replay
+######################################################################################################
+def replay(engine, edges, t_end=None):
+    """Replay a scripted edge stream through the engine.
+
+    Parameters:
+        engine (MotionHysteresis): Engine to feed.
+        edges (list): (t, level) tuples, sorted by t.
+        t_end (float): Process timeouts until this time.
+    Returns:
+        list: (t, action) tuples of all ON/OFF actions.
+    """
+    actions = []
+
+    def _poll_until(t):
+        t_next = engine.time_to_next(t_poll[0])
+        while t_next is not None and t_poll[0] + t_next <= t:
+            t_poll[0] += t_next
+            action = engine.poll(t_poll[0])
+            if action is not None:
+                actions.append((t_poll[0], action))
+            t_next = engine.time_to_next(t_poll[0])
+        t_poll[0] = t
+
+    t_poll = [edges[0][0] if edges else 0.0]
+    for t, level in edges:
+        _poll_until(t)
+        action = engine.feed(t, level)
+        if action is not None:
+            actions.append((t, action))
+    if t_end is not None:
+        _poll_until(t_end)
+    return actions
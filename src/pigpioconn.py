@@ -0,0 +1,306 @@
+'''
+Project:    Pi Floor Light
+
+File:       src/pigpioconn.py
+
+Title:      Managed pigpio Connection
+
+Abstract:   This module provides ManagedPi, a drop-in replacement for pigpio.pi which
+            survives restarts of the pigpio daemon. A watchdog thread checks the health of
+            the connection periodically (one TICK command), and every call which fails on a
+            dead socket triggers a reconnect as well. Reconnects are retried with exponential
+            backoff. After reconnecting, the last known state of every pin is replayed: GPIO
+            modes, pull-ups/downs, glitch filters, hardware PWM (frequency and duty cycle) and
+            edge callbacks, so the LEDs come back at their last duty cycle and motion
+            callbacks keep working.
+
+            Every call holds the lock of the connection, so a reconnect never stops a
+            pigpio.pi which another thread is still using. Edges which happened while the
+            daemon was down are lost; users of callbacks register a reconnect handler to
+            re-read their pins (see motion.MotionInput).
+
+            The time from detecting the failure to the completed replay is recorded as the
+            recovery time. See fakepigpiod.py for a local fake daemon to test against.
+
+Author:     Dr. Oliver Opalko
+
+Email:      oliver.opalko@gmail.com
+
+'''
+#!/usr/bin/env python3
+import os
+import time
+import struct
+import threading
+import pigpio
+
+######################################################################################################
+# Constants
+######################################################################################################
+
+T_HEALTH          = 1.0   # Period of the health check (seconds)
+BACKOFF_MIN       = 0.05  # First reconnect delay (seconds)
+BACKOFF_MAX       = 2.0   # Max. reconnect delay (seconds)
+T_CONNECT_TIMEOUT = 10.0  # Max. time to wait for pigpiod at start (seconds)
+
+# Errors of the pigpio socket when the daemon is gone: send() fails with an
+# OSError, recv() returns no data and struct.unpack fails. A stopped pigpio.pi
+# has no socket any more (sl.s is None), which raises an AttributeError.
+CONNECTION_ERRORS = (OSError, struct.error, AttributeError)
+
+######################################################################################################
+# Managed Callback
+######################################################################################################
+class ManagedCallback:
+    """Edge callback which is re-registered on every reconnect."""
+    def __init__(self, managed_pi, gpio, edge, func):
+        self.managed_pi = managed_pi
+        self.gpio       = gpio
+        self.edge       = edge
+        self.func       = func
+        self._cb        = None
+
+    def _register(self, pi):
+        self._cb = pi.callback(self.gpio, self.edge, self.func)
+
+    def cancel(self):
+        self.managed_pi._cancel_callback(self)
+
+######################################################################################################
+# Managed pigpio Connection
+######################################################################################################
+class ManagedPi:
+    """pigpio.pi with health checks, reconnect with backoff and state replay.
+    Methods which are not wrapped explicitly are forwarded to pigpio.pi and
+    protected by the reconnect as well.
+
+    Parameters:
+        host (str): Host of pigpiod.
+        port (int): Port of pigpiod.
+        T_health (float): Period of the health check in seconds, 0 disables the watchdog.
+        backoff_max (float): Max. reconnect delay in seconds.
+        T_connect_timeout (float): Max. time to wait for pigpiod at start in seconds.
+    """
+    def __init__(self, host=None, port=None, T_health=T_HEALTH, backoff_max=BACKOFF_MAX,
+                 T_connect_timeout=T_CONNECT_TIMEOUT):
+        # Public attributes
+        self.host        = host if host is not None else os.getenv("PIGPIO_ADDR", "localhost")
+        self.port        = int(port if port is not None else os.getenv("PIGPIO_PORT", 8888))
+        self.T_health    = T_health
+        self.backoff_max = backoff_max
+        self.b_auto_reconnect = True
+
+        # Statistics
+        self.n_reconnect      = 0
+        self.T_recovery_last  = None
+        self.T_recovery_max   = 0.0
+
+        # Private attributes
+        self._lock       = threading.RLock()
+        self._generation = 0
+        self._b_stopped  = False
+        self._stop_event = threading.Event()
+        self._modes      = {}  # gpio -> mode
+        self._pulls      = {}  # gpio -> pud
+        self._glitch     = {}  # gpio -> steady (us)
+        self._pwm        = {}  # gpio -> (frequency, duty)
+        self._callbacks  = []
+        self._reconnect_handlers = []
+
+        self._pi = self._connect(T_connect_timeout)
+        if self._pi is None:
+            raise RuntimeError("Keine Verbindung zu pigpiod – läuft der Daemon?")
+
+        self._watchdog = None
+        if self.T_health:
+            self._watchdog = threading.Thread(target=self._watchdog_loop, daemon=True)
+            self._watchdog.start()
+
+    #########################################################
+    # Private Helper Methods
+    #########################################################
+
+    def _connect(self, T_timeout=None):
+        """Connect to pigpiod, retrying with exponential backoff.
+        Returns:
+            pigpio.pi: Connected instance, None on timeout or stop.
+        """
+        t_end = None if T_timeout is None else time.monotonic() + T_timeout
+        backoff = BACKOFF_MIN
+        while not self._b_stopped:
+            pi = pigpio.pi(self.host, self.port, show_errors=False)
+            if pi.connected:
+                return pi
+            if t_end is not None and time.monotonic() + backoff > t_end:
+                return None
+            self._stop_event.wait(backoff)
+            backoff = min(2*backoff, self.backoff_max)
+        return None
+
+    def _replay(self, pi):
+        """Restore the last known state of every pin on a new connection."""
+        for gpio, mode in self._modes.items():
+            pi.set_mode(gpio, mode)
+        for gpio, pud in self._pulls.items():
+            pi.set_pull_up_down(gpio, pud)
+        for gpio, steady in self._glitch.items():
+            pi.set_glitch_filter(gpio, steady)
+        for gpio, (frequency, duty) in self._pwm.items():
+            pi.hardware_PWM(gpio, frequency, duty)
+        for callback in self._callbacks:
+            callback._register(pi)
+
+    def _stop_quietly(self, pi):
+        try:
+            pi.stop()
+        except CONNECTION_ERRORS:
+            pass
+
+    def _reconnect(self, generation, reason):
+        """Replace a dead connection. Does nothing if another thread already
+        replaced the connection of the given generation. The reconnect
+        handlers are called afterwards, outside of the lock."""
+        with self._lock:
+            if generation != self._generation:
+                return
+            if not self.b_auto_reconnect or self._b_stopped:
+                raise ConnectionError(f"pigpiod connection lost: {reason}")
+            t_fail = time.monotonic()
+            print(f"pigpiod connection lost ({reason}), reconnecting...")
+            self._stop_quietly(self._pi)
+            while True:
+                pi = self._connect()
+                if pi is None:
+                    raise ConnectionError("pigpiod connection stopped while reconnecting")
+                try:
+                    self._replay(pi)
+                    break
+                except CONNECTION_ERRORS as e:
+                    # Daemon died again during the replay
+                    reason = e
+                    self._stop_quietly(pi)
+            self._pi = pi
+            self._generation += 1
+            self.n_reconnect += 1
+            self.T_recovery_last = time.monotonic() - t_fail
+            self.T_recovery_max = max(self.T_recovery_max, self.T_recovery_last)
+            print("Reconnected to pigpiod in {:.3f} s, replayed {} PWM and {} callback(s)".format(
+                self.T_recovery_last, len(self._pwm), len(self._callbacks)))
+        for handler in self._reconnect_handlers:
+            try:
+                handler()
+            except Exception as e:
+                print(f"Error in reconnect handler {handler}: {e}")
+
+    def _call(self, name, *args):
+        """Call a pigpio.pi method, reconnect and retry once on a dead socket.
+        The call holds the lock, so the connection is not replaced under it."""
+        with self._lock:
+            generation = self._generation
+            try:
+                return getattr(self._pi, name)(*args)
+            except CONNECTION_ERRORS as e:
+                error = e
+        self._reconnect(generation, error)
+        with self._lock:
+            return getattr(self._pi, name)(*args)
+
+    def _watchdog_loop(self):
+        while not self._stop_event.wait(self.T_health):
+            with self._lock:
+                generation = self._generation
+                try:
+                    self._pi.get_current_tick()
+                    continue
+                except CONNECTION_ERRORS as e:
+                    error = e
+            try:
+                self._reconnect(generation, error)
+            except ConnectionError:
+                return
+
+    def _cancel_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+            try:
+                if callback._cb is not None:
+                    callback._cb.cancel()
+            except CONNECTION_ERRORS:
+                pass
+
+    #########################################################
+    # Public Methods (pigpio.pi interface)
+    #########################################################
+
+    @property
+    def connected(self):
+        return not self._b_stopped and self._pi.connected
+
+    def set_mode(self, gpio, mode):
+        with self._lock:
+            self._modes[gpio] = mode
+        return self._call("set_mode", gpio, mode)
+
+    def set_pull_up_down(self, gpio, pud):
+        with self._lock:
+            self._pulls[gpio] = pud
+        return self._call("set_pull_up_down", gpio, pud)
+
+    def set_glitch_filter(self, gpio, steady):
+        with self._lock:
+            if steady:
+                self._glitch[gpio] = steady
+            else:
+                self._glitch.pop(gpio, None)
+        return self._call("set_glitch_filter", gpio, steady)
+
+    def hardware_PWM(self, gpio, PWMfreq, PWMduty):
+        with self._lock:
+            self._pwm[gpio] = (PWMfreq, PWMduty)
+        return self._call("hardware_PWM", gpio, PWMfreq, PWMduty)
+
+    def callback(self, user_gpio, edge=pigpio.RISING_EDGE, func=None):
+        callback = ManagedCallback(self, user_gpio, edge, func)
+        with self._lock:
+            self._callbacks.append(callback)
+            generation = self._generation
+            try:
+                callback._register(self._pi)
+                return callback
+            except CONNECTION_ERRORS as e:
+                error = e
+        # The reconnect registers the callback on the new connection
+        self._reconnect(generation, error)
+        return callback
+
+    def add_reconnect_handler(self, handler):
+        """Register handler(), called after every reconnect and replay, e.g.
+        to re-read input levels which changed while the daemon was down."""
+        self._reconnect_handlers.append(handler)
+
+    def __getattr__(self, name):
+        # Forward everything else (read, write, get_current_tick, ...)
+        if name.startswith("_") or not callable(getattr(pigpio.pi, name, None)):
+            raise AttributeError(name)
+        return lambda *args: self._call(name, *args)
+
+    def get_stats(self):
+        """Return the reconnect statistics.
+        Returns:
+            dict: Number of reconnects and recovery times in seconds.
+        """
+        return {
+            "n_reconnect":     self.n_reconnect,
+            "T_recovery_last": self.T_recovery_last,
+            "T_recovery_max":  self.T_recovery_max,
+        }
+
+    def stop(self):
+        """Stop the watchdog and release the connection."""
+        self._b_stopped = True
+        self._stop_event.set()
+        if self._watchdog is not None and self._watchdog is not threading.current_thread():
+            self._watchdog.join(timeout=1.0)
+        with self._lock:
+            self._stop_quietly(self._pi)
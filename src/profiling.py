@@ -0,0 +1,232 @@
+'''
+Project:    Pi Floor Light
+
+File:       src/profiling.py
+
+Title:      Runtime Profiling Hooks
+
+Abstract:   This module provides opt-in profiling hooks for the running service, which can
+            be triggered by signals when no debugger can be attached:
+
+                kill -USR1 <pid>   Toggle cProfile of the controller for a time window
+                                   (stops by itself after window seconds). The hot-path
+                                   timers and tracemalloc run during the window as well.
+                kill -USR2 <pid>   Dump the tracemalloc top allocations and the hot-path
+                                   timers. Outside of a profiling window, the first USR2
+                                   starts tracing and the next one dumps and stops it.
+
+            The hot-path timers wrap LedPair.ramp_ab, BH1750.read_raw (the I2C read of
+            every lux mode), BH1750.read_lux_adaptive and the per-iteration work of every
+            control loop (LEDControl.light_on_motion, MotionHysteresis.feed,
+            ClosedLoopLux.step) only while tracing, and the original methods are restored
+            afterwards. With the hooks idle, nothing but the signal handlers is installed, so
+            there is no overhead. All output is written to files in out_dir.
+
+            Signal handlers run in the main thread, which is also the controller thread, so
+            cProfile profiles the controller. The window is ended with SIGALRM for the same
+            reason (cProfile has to be disabled in the thread it was enabled in).
+
+Author:     Dr. Oliver Opalko
+
+Email:      oliver.opalko@gmail.com
+
+'''
+#!/usr/bin/env python3
+import io
+import sys
+import time
+import signal
+import pstats
+import cProfile
+import functools
+import tracemalloc
+from pathlib import Path
+
+######################################################################################################
+# Constants
+######################################################################################################
+
+# (module, class, method) of the hot paths with timers
+HOT_PATHS = [
+    ("leddriver",    "LedPair",          "ramp_ab"),
+    ("bh1750",       "BH1750",           "read_raw"),           # I2C transfer of every lux reading
+    ("bh1750",       "BH1750",           "read_lux_adaptive"),  # Adaptive one-shots incl. conversion time
+    ("ledcontrol",   "LEDControl",       "light_on_motion"),    # Per iteration of the lux loops
+    ("motionevents", "MotionHysteresis", "feed"),               # Per PIR edge of the hysteresis loop
+    ("luxcontrol",   "ClosedLoopLux",    "step"),               # Per tick of the closed loop
+]
+N_TOP      = 25   # Number of entries in the dumps
+N_FRAMES   = 5    # tracemalloc traceback depth
+OUT_DIR    = "/tmp/floorlight-profile"
+
+######################################################################################################
+# Hot-Path Timer
+######################################################################################################
+class HotPathTimer:
+    """Call count and wall time of a method, collected by a wrapper which is
+    only installed while tracing."""
+    def __init__(self, name):
+        self.name    = name
+        self.n_call  = 0
+        self.T_sum   = 0.0
+        self.T_max   = 0.0
+
+    def wrap(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            t_start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                T = time.perf_counter() - t_start
+                self.n_call += 1
+                self.T_sum += T
+                if T > self.T_max:
+                    self.T_max = T
+        return wrapper
+
+    def format(self):
+        T_mean = self.T_sum / self.n_call if self.n_call else 0.0
+        return "{:<30} calls: {:>7}  total: {:>9.3f} s  mean: {:>9.3f} ms  max: {:>9.3f} ms".format(
+            self.name, self.n_call, self.T_sum, 1e3 * T_mean, 1e3 * self.T_max)
+
+######################################################################################################
+# Profiler
+######################################################################################################
+class Profiler:
+    """Signal-triggered cProfile, tracemalloc and hot-path timers.
+
+    Parameters:
+        out_dir (str): Directory for the output files.
+        window (float): Length of a cProfile window in seconds.
+    """
+    def __init__(self, out_dir=OUT_DIR, window=30.0):
+        self.out_dir = Path(out_dir)
+        self.window  = window
+        self.timers  = {}
+
+        # Private attributes
+        self._profile   = None
+        self._originals = {}  # (class, method) -> original function
+        self._b_tracing = False
+
+    #########################################################
+    # Private Helper Methods
+    #########################################################
+
+    def _get_path(self, prefix, suffix):
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        return self.out_dir / "{}_{}{}".format(prefix, time.strftime("%Y%m%d_%H%M%S"), suffix)
+
+    def _install_timers(self):
+        for module_name, class_name, method_name in HOT_PATHS:
+            module = sys.modules.get(module_name)
+            cls = getattr(module, class_name, None)
+            if cls is None or (cls, method_name) in self._originals:
+                continue
+            name = "{}.{}".format(class_name, method_name)
+            timer = self.timers.setdefault(name, HotPathTimer(name))
+            original = cls.__dict__[method_name]
+            self._originals[(cls, method_name)] = original
+            setattr(cls, method_name, timer.wrap(original))
+
+    def _remove_timers(self):
+        for (cls, method_name), original in self._originals.items():
+            setattr(cls, method_name, original)
+        self._originals = {}
+
+    def _start_tracing(self):
+        if self._b_tracing:
+            return
+        self.timers = {}
+        self._install_timers()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(N_FRAMES)
+        self._b_tracing = True
+
+    def _stop_tracing(self):
+        if not self._b_tracing:
+            return
+        self._remove_timers()
+        tracemalloc.stop()
+        self._b_tracing = False
+
+    def _on_usr1(self, signum, frame):
+        if self._profile is None:
+            self.start_profile()
+        else:
+            self.stop_profile()
+
+    def _on_usr2(self, signum, frame):
+        if not self._b_tracing:
+            self._start_tracing()
+            print("Profiler: tracemalloc and hot-path timers started, send SIGUSR2 again to dump.")
+            return
+        self.dump_memory()
+        if self._profile is None:
+            self._stop_tracing()
+
+    def _on_alarm(self, signum, frame):
+        self.stop_profile()
+
+    #########################################################
+    # Public Methods
+    #########################################################
+
+    def install(self):
+        """Install the signal handlers (main thread only)."""
+        signal.signal(signal.SIGUSR1, self._on_usr1)
+        signal.signal(signal.SIGUSR2, self._on_usr2)
+        signal.signal(signal.SIGALRM, self._on_alarm)
+        print("Profiler: SIGUSR1 toggles a {:g} s cProfile window, SIGUSR2 dumps memory and timers to {}".format(
+            self.window, self.out_dir))
+
+    def start_profile(self):
+        """Start a cProfile window in the calling (main) thread."""
+        if self._profile is not None:
+            return
+        self._start_tracing()
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        signal.setitimer(signal.ITIMER_REAL, self.window)
+        print("Profiler: cProfile started for {:g} s.".format(self.window))
+
+    def stop_profile(self):
+        """Stop the cProfile window and write the statistics."""
+        if self._profile is None:
+            return
+        self._profile.disable()
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        profile, self._profile = self._profile, None
+
+        path = self._get_path("profile", ".txt")
+        profile.dump_stats(str(path.with_suffix(".prof")))
+        stream = io.StringIO()
+        stats = pstats.Stats(profile, stream=stream)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(N_TOP)
+        with open(path, "w") as f:
+            f.write("# Hot-path timers\n")
+            for timer in self.timers.values():
+                f.write(timer.format() + "\n")
+            f.write("\n# cProfile (cumulative)\n")
+            f.write(stream.getvalue())
+        self._stop_tracing()
+        print("Profiler: cProfile written to {}".format(path))
+
+    def dump_memory(self):
+        """Write the tracemalloc top allocations and the hot-path timers."""
+        path = self._get_path("memory", ".txt")
+        with open(path, "w") as f:
+            f.write("# Hot-path timers\n")
+            for timer in self.timers.values():
+                f.write(timer.format() + "\n")
+            f.write("\n# tracemalloc top {} allocations\n".format(N_TOP))
+            if tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                f.write("current: {:.1f} KiB, peak: {:.1f} KiB\n".format(current / 1024, peak / 1024))
+                snapshot = tracemalloc.take_snapshot()
+                for stat in snapshot.statistics("lineno")[:N_TOP]:
+                    f.write(str(stat) + "\n")
+            else:
+                f.write("tracemalloc is not tracing\n")
+        print("Profiler: memory and timers written to {}".format(path))
@@ -45,6 +45,10 @@ class PwmGPIO:
         self.pwm.ChangeFrequency(frequency)
         self.pwm.ChangeDutyCycle(duty_cycle)
 
+    def set_duty(self, duty_cycle):
+        """Change only the duty cycle (percent), the frequency stays."""
+        self.pwm.ChangeDutyCycle(duty_cycle)
+
     def stop(self):
         """Stop PWM."""
         self.pwm.stop()
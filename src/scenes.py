@@ -0,0 +1,190 @@
+'''
+Project:    Pi Floor Light
+
+File:       src/scenes.py
+
+Title:      Time-of-Day Scenes
+
+Abstract:   This module provides a scene scheduler which adapts the light to the time of
+            day: a dim night light at 3 am, a brighter light in the evening. A scene sets a
+            brightness cap and floor, the ramp time and the no-motion timeout; values which
+            are not set keep the defaults of the control loop.
+
+            The rules of the config section "scenes" are parsed once. Once per day they are
+            compiled into a timeline: an index with one byte per minute of the day pointing
+            to the active scene. The controller looks up the current scene with a single
+            index access and never re-parses the rules. Later rules take precedence over
+            earlier ones, and a rule that crosses midnight (e.g. 23:00-06:00) belongs to
+            the day it starts on, which matters for rules limited to certain weekdays.
+
+Author:     Dr. Oliver Opalko
+
+Email:      oliver.opalko@gmail.com
+
+'''
+#!/usr/bin/env python3
+import time
+import datetime
+
+######################################################################################################
+# Constants
+######################################################################################################
+
+N_MINUTE   = 24 * 60
+N_RULE_MAX = 255  # Scene indices are stored as bytes, index 0 is the default scene
+WEEKDAYS   = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+######################################################################################################
+# Scene
+######################################################################################################
+class Scene:
+    """Light settings for a time window. None keeps the default of the control loop.
+
+    Parameters:
+        name (str): Name of the scene.
+        duty_min (float): Min. duty cycle (percent) when the LED is turned on.
+        duty_max (float): Max. duty cycle (percent).
+        T_ramp (float): Ramp time in seconds for the full range (0-100%).
+        timeout (float): No-motion time in seconds until the LED is turned off.
+    """
+    def __init__(self, name, duty_min=None, duty_max=None, T_ramp=None, timeout=None):
+        self.name     = name
+        self.duty_min = duty_min
+        self.duty_max = duty_max
+        self.T_ramp   = T_ramp
+        self.timeout  = timeout
+
+    def clamp(self, duty):
+        """Apply the brightness cap and floor. A duty cycle of 0 (bright
+        enough, do not turn on) stays 0.
+        Returns:
+            float: Duty cycle in percent.
+        """
+        if duty <= 0:
+            return duty
+        if self.duty_max is not None and duty > self.duty_max:
+            duty = self.duty_max
+        if self.duty_min is not None and duty < self.duty_min:
+            duty = self.duty_min
+        return duty
+
+    def get_timeout(self, timeout):
+        """Return the timeout of the scene, the given default if not set."""
+        return timeout if self.timeout is None else self.timeout
+
+    def format(self):
+        return "{:<10} duty: {}..{}%  T_ramp: {} s  timeout: {} s".format(
+            self.name,
+            "-" if self.duty_min is None else self.duty_min,
+            "-" if self.duty_max is None else self.duty_max,
+            "-" if self.T_ramp is None else self.T_ramp,
+            "-" if self.timeout is None else self.timeout)
+
+######################################################################################################
+# Private Helper Functions
+######################################################################################################
+def _parse_minute(value):
+    """Parse "HH:MM" to the minute of the day."""
+    try:
+        hour, minute = (int(part) for part in str(value).split(":"))
+    except ValueError:
+        raise ValueError(f"Invalid scene time {value!r}, expected HH:MM")
+    if not (0 <= hour <= 24 and 0 <= minute < 60) or hour * 60 + minute > N_MINUTE:
+        raise ValueError(f"Invalid scene time {value!r}, expected HH:MM")
+    return hour * 60 + minute
+
+def _parse_days(days):
+    """Parse a list of weekday names to a set of weekday numbers (Monday: 0)."""
+    if not days:
+        return set(range(7))
+    try:
+        return {WEEKDAYS.index(str(day).lower()[:3]) for day in days}
+    except ValueError:
+        raise ValueError(f"Invalid scene days {days!r}, expected e.g. [mon, sat, sun]")
+
+def _get_scene(name, cfg):
+    return Scene(
+            name     =name,
+            duty_min =cfg.get("duty_min"),
+            duty_max =cfg.get("duty_max"),
+            T_ramp   =cfg.get("T_ramp"),
+            timeout  =cfg.get("timeout"))
+
+######################################################################################################
+# Scene Schedule
+######################################################################################################
+class SceneSchedule:
+    """Daily timeline of scenes compiled from the "scenes" config section.
+
+    Parameters:
+        config_scenes (dict): Config section "scenes" with "default" and "rules".
+    """
+    def __init__(self, config_scenes: dict):
+        rules = config_scenes.get("rules") or []
+        if len(rules) > N_RULE_MAX:
+            raise ValueError(f"At most {N_RULE_MAX} scene rules are supported")
+
+        # Parsed once: scene index 0 is the default, rule i has scene index i+1
+        self.scenes = [_get_scene("default", config_scenes.get("default") or {})]
+        self._rules = []  # (scene index, start minute, end minute, weekdays)
+        for i, rule in enumerate(rules):
+            self.scenes.append(_get_scene(rule.get("name", f"scene_{i+1}"), rule))
+            self._rules.append((
+                i + 1,
+                _parse_minute(rule["start"]),
+                _parse_minute(rule["end"]),
+                _parse_days(rule.get("days"))))
+
+        # Compiled timeline of the current day
+        self.date     = None
+        self.timeline = []  # (start minute, scene) of every change, sorted
+        self._index   = bytearray(N_MINUTE)
+        self._day     = None  # (tm_year, tm_yday) of the compiled timeline
+
+    #########################################################
+    # Public Methods
+    #########################################################
+
+    def compile(self, date):
+        """Compile the timeline of the given day (datetime.date)."""
+        index = bytearray(N_MINUTE)
+        weekday = date.weekday()
+        weekday_before = (weekday - 1) % 7
+        for i_scene, start, end, days in self._rules:
+            if end > start:
+                if weekday in days:
+                    index[start:end] = bytes([i_scene]) * (end - start)
+            else:
+                # Crosses midnight: the evening part belongs to today,
+                # the morning part to the rule of the day before
+                if weekday in days:
+                    index[start:] = bytes([i_scene]) * (N_MINUTE - start)
+                if weekday_before in days:
+                    index[:end] = bytes([i_scene]) * end
+
+        timeline = []
+        i_last = None
+        for minute, i_scene in enumerate(index):
+            if i_scene != i_last:
+                timeline.append((minute, self.scenes[i_scene]))
+                i_last = i_scene
+        self._index   = index
+        self.timeline = timeline
+        self.date     = date
+        self._day     = (date.year, date.timetuple().tm_yday)
+
+    def get_scene(self, t=None):
+        """Return the scene active at time t (time.time(), None: now). The
+        timeline is recompiled when the date changes.
+        Returns:
+            Scene: Active scene.
+        """
+        lt = time.localtime(t)
+        if (lt.tm_year, lt.tm_yday) != self._day:
+            self.compile(datetime.date(lt.tm_year, lt.tm_mon, lt.tm_mday))
+        return self.scenes[self._index[lt.tm_hour * 60 + lt.tm_min]]
+
+    def print_timeline(self):
+        print("Scenes of {}:".format(self.date))
+        for minute, scene in self.timeline:
+            print("  {:02d}:{:02d} {}".format(minute // 60, minute % 60, scene.format()))
@@ -0,0 +1,186 @@
+'''
+Project:    Pi Floor Light
+
+File:       src/statefile.py
+
+Title:      Persistent State Snapshot
+
+Abstract:   This module provides a small memory-mapped state file which records the live
+            duty cycle of every LED channel, the last lux reading and the state of the
+            closed-loop controller. Every update is a few struct.pack_into calls into the
+            mapping, so it is cheap enough to be done on every PWM write. The page cache
+            keeps the data when the process crashes or is restarted by systemd, so the
+            service can resume exactly where it left off instead of ramping from zero.
+
+            Updates are guarded by a sequence counter (odd while writing), so a snapshot
+            which was torn by a crash in the middle of an update is detected and ignored.
+            The writers run in several threads (PWM writes in the control loop, lux readings
+            in the LuxStream thread), so every update holds a lock.
+            The default location in /dev/shm is cleared on reboot, when the LEDs are off
+            anyway.
+
+            Layout (little endian, fixed size):
+                magic (4s), version (H), n_channel (H), seq (I), pad (I), t_update (d),
+                lux (d), integral (d), target_lux (d),
+                N_CHANNEL_MAX x (pin (i), pad (I), duty (d))
+
+Author:     Dr. Oliver Opalko
+
+Email:      oliver.opalko@gmail.com
+
+'''
+#!/usr/bin/env python3
+import os
+import mmap
+import time
+import math
+import struct
+import threading
+
+######################################################################################################
+# Constants
+######################################################################################################
+
+MAGIC         = b"FLST"
+VERSION       = 1
+N_CHANNEL_MAX = 4
+HEADER        = struct.Struct("<4sHHIIdddd")
+CHANNEL       = struct.Struct("<iId")
+SEQ           = struct.Struct("<I")
+T_UPDATE      = struct.Struct("<d")
+VALUE         = struct.Struct("<d")
+OFFSET_SEQ        = 8
+OFFSET_T_UPDATE   = 16
+OFFSET_LUX        = 24
+OFFSET_INTEGRAL   = 32
+OFFSET_TARGET_LUX = 40
+OFFSET_CHANNELS   = HEADER.size
+SIZE          = HEADER.size + N_CHANNEL_MAX * CHANNEL.size
+PIN_NONE      = -1
+STATE_PATH    = "/dev/shm/floorlight.state"
+
+######################################################################################################
+# State File
+######################################################################################################
+class StateFile:
+    """Memory-mapped snapshot of the live LED state.
+
+    Parameters:
+        path (str): Path of the state file.
+    """
+    def __init__(self, path=STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != SIZE:
+                os.ftruncate(fd, SIZE)
+            self._mm = mmap.mmap(fd, SIZE)
+        finally:
+            os.close(fd)
+
+        # Snapshot of the previous run (None if there is no valid one)
+        self.restored = self._read()
+        self._seq = SEQ.unpack_from(self._mm, OFFSET_SEQ)[0] & ~1
+        self._channels = {}  # pin -> offset of the channel slot
+        if self.restored is None:
+            self._init()
+        else:
+            for i, pin in enumerate(self.restored["duty"]):
+                self._channels[pin] = OFFSET_CHANNELS + i * CHANNEL.size
+
+    #########################################################
+    # Private Helper Methods
+    #########################################################
+
+    def _init(self):
+        self._mm[:] = bytes(SIZE)
+        HEADER.pack_into(self._mm, 0, MAGIC, VERSION, N_CHANNEL_MAX, 0, 0, 0.0, math.nan, 0.0, math.nan)
+        for i in range(N_CHANNEL_MAX):
+            CHANNEL.pack_into(self._mm, OFFSET_CHANNELS + i * CHANNEL.size, PIN_NONE, 0, 0.0)
+        self._seq = 0
+
+    def _read(self):
+        """Read and validate the snapshot in the mapping.
+        Returns:
+            dict: Snapshot, None if missing, of another version or torn.
+        """
+        magic, version, n_channel, seq, pad, t_update, lux, integral, target_lux = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION or n_channel != N_CHANNEL_MAX or seq & 1:
+            return None
+        duty = {}
+        for i in range(N_CHANNEL_MAX):
+            pin, pad, duty_pin = CHANNEL.unpack_from(self._mm, OFFSET_CHANNELS + i * CHANNEL.size)
+            if pin != PIN_NONE:
+                duty[pin] = duty_pin
+        return {
+            "t_update":   t_update,
+            "lux":        None if math.isnan(lux) else lux,
+            "integral":   integral,
+            "target_lux": None if math.isnan(target_lux) else target_lux,
+            "duty":       duty,
+        }
+
+    def _begin(self):
+        self._seq += 1
+        SEQ.pack_into(self._mm, OFFSET_SEQ, self._seq & 0xFFFFFFFF)
+
+    def _end(self):
+        T_UPDATE.pack_into(self._mm, OFFSET_T_UPDATE, time.time())
+        self._seq += 1
+        SEQ.pack_into(self._mm, OFFSET_SEQ, self._seq & 0xFFFFFFFF)
+
+    def _get_channel_offset(self, pin):
+        offset = self._channels.get(pin)
+        if offset is None:
+            if len(self._channels) >= N_CHANNEL_MAX:
+                raise ValueError(f"State file supports at most {N_CHANNEL_MAX} channels")
+            offset = OFFSET_CHANNELS + len(self._channels) * CHANNEL.size
+            self._channels[pin] = offset
+        return offset
+
+    #########################################################
+    # Public Methods
+    #########################################################
+
+    def set_duty(self, pin_a, duty_a, pin_b=None, duty_b=None):
+        """Record the duty cycle (percent) of one or two channels."""
+        with self._lock:
+            self._begin()
+            CHANNEL.pack_into(self._mm, self._get_channel_offset(pin_a), pin_a, 0, duty_a)
+            if pin_b is not None:
+                CHANNEL.pack_into(self._mm, self._get_channel_offset(pin_b), pin_b, 0, duty_b)
+            self._end()
+
+    def set_lux(self, lux):
+        """Record the last lux reading."""
+        with self._lock:
+            self._begin()
+            VALUE.pack_into(self._mm, OFFSET_LUX, lux)
+            self._end()
+
+    def set_controller(self, integral, target_lux):
+        """Record the state of the closed-loop controller."""
+        with self._lock:
+            self._begin()
+            VALUE.pack_into(self._mm, OFFSET_INTEGRAL, integral)
+            VALUE.pack_into(self._mm, OFFSET_TARGET_LUX, target_lux)
+            self._end()
+
+    def get_resume(self, max_age=None):
+        """Return the snapshot of the previous run if it is recent enough
+        (max_age in seconds since the last update, None: no limit).
+        Returns:
+            dict: Snapshot, None if there is nothing to resume.
+        """
+        if self.restored is None:
+            return None
+        if max_age is not None and time.time() - self.restored["t_update"] > max_age:
+            return None
+        return self.restored
+
+    def close(self):
+        """Flush the mapping to the file and unmap it."""
+        with self._lock:
+            self._mm.flush()
+            self._mm.close()